@@ -0,0 +1,274 @@
+import argparse, os, random, shlex, subprocess, sys, tempfile, time, tracemalloc
+import preprocess
+from grammar import GRAMMAR_DIR
+from precompiled import precompile
+
+arg_parser = argparse.ArgumentParser(
+                    prog='CPPE Preprocessor Benchmark',
+                    description='Times the preprocessor on synthetic CPPE sources')
+arg_parser.add_argument("-s", "--size", type=int, default=200, help="number of top-level functions to generate per scenario")
+arg_parser.add_argument("-d", "--depth", type=int, default=4, help="how deeply constructs nest within each function")
+arg_parser.add_argument("-r", "--repeat", type=int, default=5, help="number of times each scenario is timed (the best time is reported)")
+arg_parser.add_argument("-S", "--scenario", action="append", help="only run the named scenario(s)")
+arg_parser.add_argument("-g", "--grammar", default=GRAMMAR_DIR)
+arg_parser.add_argument("-l", "--library", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "library", "CPPE.hpp"))
+arg_parser.add_argument("-o", "--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_output.txt"))
+arg_parser.add_argument("--seed", type=int, default=0)
+arg_parser.add_argument("--compile", metavar="COMMAND", help="also time compiling each scenario's output with this compiler command, with and without the precompiled library")
+arg_parser.add_argument("--run", metavar="COMMAND", help="also compile (with this compiler command) and time running a loop which continues to its label under each lowering")
+arg_parser.add_argument("--dump", help="directory to write the generated sources to (for inspection)")
+
+
+
+# Each generator returns the body of one function, nesting its construct `depth` levels deep
+
+def generate_plain(rng: random.Random, depth: int, i: int) -> str:
+	if depth == 0: return f"total += values[{rng.randint(0, 9)}] * {rng.randint(1, 100)};"
+	return f"for (int i{depth} = 0; i{depth} < {rng.randint(2, 10)}; ++i{depth}) {{\n{generate_plain(rng, depth - 1, i)}\n\tif (total > {rng.randint(100, 1000)}) total -= i{depth};\n}}"
+
+def generate_labeled_loops(rng: random.Random, depth: int, i: int) -> str:
+	def loop(level: int) -> str:
+		if level == 0: return f"if (total % {rng.randint(2, 7)} == 0) continue outer{rng.randint(1, max(depth, 1))};\ntotal += {rng.randint(1, 9)};"
+		return f"outer{level}: for (int i{level} = 0; i{level} < {rng.randint(2, 10)}; ++i{level}) {{\n{loop(level - 1)}\n\tif (total > {rng.randint(100, 1000)}) break outer{level};\n}}"
+	return loop(depth)
+
+def generate_if_expressions(rng: random.Random, depth: int, i: int) -> str:
+	def expression(depth: int) -> str:
+		if depth == 0: return str(rng.randint(0, 100))
+		return f"if (total > {rng.randint(0, 100)}) {{ {expression(depth - 1)} }} else {{ {expression(depth - 1)} }}"
+	return f"auto value = {expression(depth)};\ntotal += value;"
+
+def generate_sum_product_types(rng: random.Random, depth: int, i: int) -> str:
+	def type(depth: int) -> str:
+		if depth == 0: return rng.choice(["int", "float", "double", "std::string", "char"])
+		if rng.random() < 0.5: return f"{type(depth - 1)} | {type(depth - 1)}"
+		return f"({type(depth - 1)}, {type(depth - 1)})"
+	return "\n".join(f"{type(depth)} value{j};" for j in range(depth)) + f"\nint[{depth + 1}] array; int[] view = array; int[...] vector;"
+
+def generate_ufcs_chains(rng: random.Random, depth: int, i: int) -> str:
+	methods = ["size", "front", "back", "data", "begin", "end", "count", "sum"]
+	chain = "values"
+	for _ in range(depth * 2):
+		call = rng.choice(methods)
+		chain += rng.choice([f".{call}()", f".{call}({rng.randint(0, 9)})", f".{call}", f"->{call}(total, {rng.randint(0, 9)})"])
+	return f"total += {chain};"
+
+def generate_defer_yield(rng: random.Random, depth: int, i: int) -> str:
+	if depth == 0: return f"defer {{ total += {rng.randint(1, 9)}; }};\nauto value = {{ yield total * {rng.randint(1, 9)}; }};"
+	return f"{{\n\tdefer {{ total -= {depth}; }};\n{generate_defer_yield(rng, depth - 1, i)}\n}}"
+
+SCENARIOS = {
+	# name: (generator, translator hot path the scenario stresses)
+	"plain": (generate_plain, "process_default_node"),
+	"labeled-loops": (generate_labeled_loops, "process_standard_loop"),
+	"if-expressions": (generate_if_expressions, "process_if"),
+	"sum-product-types": (generate_sum_product_types, "process_sum_type/process_product_type"),
+	"ufcs-chains": (generate_ufcs_chains, "process_call_expression"),
+	"defer-yield": (generate_defer_yield, "process_compound_expression"),
+}
+
+def generate(scenario: str, size: int, depth: int, seed: int) -> bytes:
+	rng = random.Random(seed)
+	generator = SCENARIOS[scenario][0]
+	functions = ["#include <vector>\n"]
+	for i in range(size):
+		body = generator(rng, depth, i).replace("\n", "\n\t")
+		functions.append(f"fn function{i}(std::vector<int> values) -> int {{\n\tint total = 0;\n\t{body}\n\treturn total;\n}}\n")
+	functions.append("fn main() {\n\tstd::vector<int> values(3, 1);\n\treturn function0(values).size;\n}\n")
+	return "\n".join(functions).encode("utf8")
+
+# How labeled continues/breaks are lowered: (how the kernel jumps, extra compiler flags, text the translation must contain)
+# NOTE: Jumping from within a compound expression crosses a lambda, so only the first can be a goto
+LOWERINGS = {
+	"goto": ("if (j == i % 16) { continue outer; }", [], "goto CPPE_continue_outer"),
+	"exceptions": ("int skip = { if (j == i % 16) { continue outer; } yield 0; };\n\t\t\ttotal += skip;", [], "CPPE_CONTINUE(outer"),
+	"jump-state": ("int skip = { if (j == i % 16) { continue outer; } yield 0; };\n\t\t\ttotal += skip;", ["-DCPPE_JUMP_STATE"], "CPPE_CONTINUE(outer"),
+}
+
+def generate_lowering(lowering: str, size: int) -> bytes:
+	return f"""#include <vector>
+
+fn kernel(std::vector<int> values) -> int {{
+	int total = 0;
+	outer: for (int i = 0; i < (int) values.size(); ++i) {{
+		for (int j = 0; j < (int) values.size(); ++j) {{
+			{LOWERINGS[lowering][0]}
+			total += values[j];
+		}}
+	}}
+	return total;
+}}
+
+int main() {{
+	std::vector<int> values({size * 5}, 1);
+	int total = 0;
+	for (int r = 0; r < {size * 10}; ++r) total += kernel(values);
+	return total == 0;
+}}
+""".encode("utf8")
+
+def count_nodes(tree) -> int:
+	count = 0
+	cursor = tree.walk()
+	while True:
+		count += 1
+		if cursor.goto_first_child(): continue
+		while not cursor.goto_next_sibling():
+			if not cursor.goto_parent(): return count
+
+# Bytes taken up by each NodeState (including its attribute dictionary, if it has one)
+def state_size() -> int:
+	state = preprocess.NodeState()
+	return sys.getsizeof(state) + (sys.getsizeof(state.__dict__) if hasattr(state, "__dict__") else 0)
+
+
+# Translates the source once, returning the time spent in each phase
+def run_phases(parser, raw: bytes, library: str, target: str) -> dict[str, float]:
+	start = time.perf_counter()
+	unit = preprocess.TranslationUnit(raw, parser.parse(raw))
+	parsed = time.perf_counter()
+	implementation = preprocess.process(preprocess.NodeState().with_unit(unit).with_node(unit.tree.root_node))
+	processed = time.perf_counter()
+	with open(target, "w") as f:
+		f.write(preprocess.assemble(unit, implementation, library))
+	written = time.perf_counter()
+	return { "parse": parsed - start, "process": processed - parsed, "output": written - processed }
+
+def benchmark(parser, raw: bytes, library: str, target: str, repeat: int) -> dict:
+	best = None
+	for _ in range(repeat):
+		phases = run_phases(parser, raw, library, target)
+		if best is None or sum(phases.values()) < sum(best.values()): best = phases
+
+	# Memory is measured in a separate pass since tracing allocations distorts the timings
+	tracemalloc.start()
+	run_phases(parser, raw, library, target)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	total = sum(best.values())
+	nodes = count_nodes(parser.parse(raw))
+	return best | { "total": total, "peak": peak, "nodes": nodes, "KB/s": len(raw) / 1024 / total, "nodes/s": nodes / total, "B/node": peak / nodes }
+
+# Times compiling the translation: against the plain library, while the precompiled library is built from scratch (cold), and once it is cached (warm)
+def benchmark_compile(parser, raw: bytes, library: str, target: str, command: str, repeat: int) -> dict[str, float]:
+	compiler, *flags = shlex.split(command)
+	def compile(library: str, extraFlags: list[str]) -> float:
+		with open(target, "w") as f:
+			f.write(preprocess.translate(parser, raw, library))
+		start = time.perf_counter()
+		result = subprocess.run([compiler, *flags, *extraFlags, "-c", target, "-o", os.devnull], capture_output=True, text=True)
+		if result.returncode != 0:
+			errors = result.stderr.strip().split("\n")
+			raise RuntimeError(next((line for line in errors if "error" in line), errors[0]))
+		return time.perf_counter() - start
+
+	plain = min(compile(library, []) for _ in range(repeat))
+	cache = os.environ.get("CPPE_CACHE_DIR")
+	with tempfile.TemporaryDirectory(prefix="cppe-") as directory:
+		os.environ["CPPE_CACHE_DIR"] = directory # So the cold build really starts from nothing
+		try:
+			start = time.perf_counter()
+			precompiled = precompile(library, compiler, flags)
+			build = time.perf_counter() - start
+			cold = build + compile(precompiled.header, precompiled.flags)
+			warm = min(compile(precompiled.header, precompiled.flags) for _ in range(repeat))
+		finally:
+			if cache is None: del os.environ["CPPE_CACHE_DIR"]
+			else: os.environ["CPPE_CACHE_DIR"] = cache
+	return { "kind": precompiled.kind, "plain": plain, "precompile": build, "cold": cold, "warm": warm }
+
+# Times running the kernel (the best of repeat runs) translated and compiled under the given lowering
+def benchmark_lowering(parser, lowering: str, library: str, target: str, command: str, size: int, repeat: int) -> float:
+	compiler, *flags = shlex.split(command)
+	_, extraFlags, expected = LOWERINGS[lowering]
+	translation = preprocess.translate(parser, generate_lowering(lowering, size), library)
+	if expected not in translation: raise RuntimeError(f"The translation doesn't contain {expected}")
+	with open(target, "w") as f:
+		f.write(translation)
+	with tempfile.TemporaryDirectory(prefix="cppe-") as directory:
+		executable = os.path.join(directory, "kernel")
+		result = subprocess.run([compiler, *flags, *extraFlags, target, "-o", executable], capture_output=True, text=True)
+		if result.returncode != 0:
+			errors = result.stderr.strip().split("\n")
+			raise RuntimeError(next((line for line in errors if "error" in line), errors[0]))
+		best = None
+		for _ in range(repeat):
+			start = time.perf_counter()
+			if subprocess.run([executable]).returncode != 0: raise RuntimeError("The kernel computed the wrong total")
+			elapsed = time.perf_counter() - start
+			best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def main(argv: list[str] | None = None) -> int:
+	args = arg_parser.parse_args(argv)
+	scenarios = args.scenario or list(SCENARIOS.keys())
+	for scenario in scenarios:
+		if scenario not in SCENARIOS:
+			print(f"Unknown scenario {scenario}! (options: {', '.join(SCENARIOS.keys())})", file=sys.stderr)
+			return 1
+
+	parser = preprocess.create_parser(args.grammar)
+	library = preprocess.resolve_library(args.library)
+	target = args.output + ".tmp.cpp"
+
+	lines = [f"size={args.size} depth={args.depth} repeat={args.repeat} seed={args.seed} python={sys.version.split()[0]} NodeState={state_size()}B",
+		f"{'scenario':<20}{'hot path':<40}{'KB':>10}{'nodes':>10}{'parse ms':>10}{'process ms':>12}{'output ms':>11}{'KB/s':>10}{'nodes/s':>11}{'peak MB':>10}{'B/node':>9}"]
+	print(lines[0])
+	print(lines[1])
+	for scenario in scenarios:
+		raw = generate(scenario, args.size, args.depth, args.seed)
+		if args.dump is not None:
+			os.makedirs(args.dump, exist_ok=True)
+			with open(os.path.join(args.dump, scenario + ".cppe"), "wb") as f:
+				f.write(raw)
+
+		try: result = benchmark(parser, raw, library, target, args.repeat)
+		except Exception as e:
+			line = f"{scenario:<20}{SCENARIOS[scenario][1]:<40}failed: {type(e).__name__}: {e}"
+		else:
+			line = f"{scenario:<20}{SCENARIOS[scenario][1]:<40}{len(raw) / 1024:>10.1f}{result['nodes']:>10}"\
+				+ f"{result['parse'] * 1000:>10.2f}{result['process'] * 1000:>12.2f}{result['output'] * 1000:>11.2f}"\
+				+ f"{result['KB/s']:>10.1f}{result['nodes/s']:>11.0f}{result['peak'] / 1024 / 1024:>10.2f}{result['B/node']:>9.0f}"
+		print(line)
+		lines.append(line)
+
+	if args.compile is not None:
+		lines.append(f"compiling with: {args.compile}")
+		lines.append(f"{'scenario':<20}{'precompiled':>12}{'plain ms':>12}{'precompile ms':>15}{'cold ms':>12}{'warm ms':>12}{'speedup':>10}")
+		print(lines[-2])
+		print(lines[-1])
+		for scenario in scenarios:
+			raw = generate(scenario, args.size, args.depth, args.seed)
+			try: result = benchmark_compile(parser, raw, library, target, args.compile, args.repeat)
+			except Exception as e:
+				line = f"{scenario:<20}failed: {type(e).__name__}: {e}"
+			else:
+				line = f"{scenario:<20}{result['kind']:>12}{result['plain'] * 1000:>12.0f}{result['precompile'] * 1000:>15.0f}"\
+					+ f"{result['cold'] * 1000:>12.0f}{result['warm'] * 1000:>12.0f}{result['plain'] / result['warm']:>9.1f}x"
+			print(line)
+			lines.append(line)
+
+	if args.run is not None:
+		lines.append(f"running with: {args.run}")
+		lines.append(f"{'lowering':<20}{'flags':<24}{'run ms':>12}{'vs goto':>10}")
+		print(lines[-2])
+		print(lines[-1])
+		baseline = None
+		for lowering in LOWERINGS:
+			try: result = benchmark_lowering(parser, lowering, library, target, args.run, args.size, args.repeat)
+			except Exception as e:
+				line = f"{lowering:<20}failed: {type(e).__name__}: {e}"
+			else:
+				if baseline is None: baseline = result
+				line = f"{lowering:<20}{' '.join(LOWERINGS[lowering][1]):<24}{result * 1000:>12.1f}{result / baseline:>9.1f}x"
+			print(line)
+			lines.append(line)
+	if os.path.exists(target): os.remove(target)
+
+	with open(args.output, "w") as f:
+		f.write("\n".join(lines) + "\n")
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
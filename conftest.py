@@ -0,0 +1,11 @@
+# Fixtures shared by the tests
+import os, pytest
+from preprocess import Translator, GRAMMAR_DIR
+
+# NOTE: $CPPE_GRAMMAR points the tests at another grammar, they are skipped when it can't be built
+@pytest.fixture(scope="session")
+def translator() -> Translator:
+	translator = Translator(os.environ.get("CPPE_GRAMMAR", GRAMMAR_DIR))
+	try: translator.parser
+	except Exception as e: pytest.skip(f"the grammar can't be loaded: {e}")
+	return translator
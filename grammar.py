@@ -0,0 +1,97 @@
+from tree_sitter import Language
+from importlib import metadata
+import hashlib, json, os, platform, sys, time, uuid
+
+# Location of the tree-sitter-cppe submodule (independent of the current working directory!)
+GRAMMAR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tree-sitter-cppe")
+LIBRARY_SUFFIX = ".dll" if sys.platform == "win32" else ".so"
+
+# Breakdown (in seconds) of where hashing the grammar and the last call to load_language spent their time
+timings: dict[str, float] = {}
+
+# Grammar directory -> hash of its sources, every grammar is only hashed once per process (see grammar_hash)
+hashes: dict[str, str] = {}
+
+# Per-user directory the compiled grammars are cached in (can be overridden with $CPPE_CACHE_DIR)
+def cache_directory() -> str:
+	if "CPPE_CACHE_DIR" in os.environ: return os.environ["CPPE_CACHE_DIR"]
+	if sys.platform == "win32": base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+	elif sys.platform == "darwin": base = os.path.expanduser(os.path.join("~", "Library", "Caches"))
+	else: base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache")))
+	return os.path.join(base, "cppe")
+
+def tree_sitter_version() -> str:
+	try: return metadata.version("tree_sitter")
+	except metadata.PackageNotFoundError: return "unknown"
+
+# Hash of everything that influences the compiled grammar: its sources, the tree-sitter version, and the platform
+# NOTE: The sources are only read when their sizes or modification times changed since they were last hashed (the stamps are kept next to the compiled grammars)
+def grammar_hash(grammar_dir: str = GRAMMAR_DIR) -> str:
+	grammar_dir = os.path.abspath(grammar_dir)
+	if grammar_dir in hashes: return hashes[grammar_dir]
+	start = time.perf_counter()
+	src = os.path.join(grammar_dir, "src")
+	if not os.path.exists(os.path.join(src, "parser.c")):
+		raise RuntimeError(f"Grammar sources not found in {src} (did you run `git submodule update --init`?)")
+
+	header = f"{tree_sitter_version()}\0{sys.platform}\0{platform.machine()}\0"
+	files = []
+	for root, dirs, names in os.walk(src):
+		dirs.sort() # Make sure the walk order (and thus the hash) is stable
+		for name in sorted(names):
+			if os.path.splitext(name)[1] not in [".c", ".cc", ".h"]: continue
+			path = os.path.join(root, name)
+			stat = os.stat(path)
+			files.append((path, os.path.relpath(path, src).replace(os.sep, "/"), stat.st_size, stat.st_mtime_ns))
+	stamps = [header, *([relative, size, mtime] for _, relative, size, mtime in files)]
+
+	cache = cache_directory()
+	index = os.path.join(cache, f"cppe-sources-{hashlib.sha256(src.encode('utf8')).hexdigest()[:16]}.json")
+	try:
+		with open(index, encoding="utf8") as f: stamped = json.load(f)
+	except (OSError, ValueError): stamped = None
+	if isinstance(stamped, dict) and stamped.get("stamps") == stamps and isinstance(stamped.get("hash"), str): key = stamped["hash"]
+	else:
+		h = hashlib.sha256()
+		h.update(header.encode("utf8"))
+		for path, relative, _, _ in files:
+			h.update(relative.encode("utf8") + b"\0")
+			with open(path, "rb") as f:
+				h.update(f.read())
+		key = h.hexdigest()
+		temporary = f"{index}.{os.getpid()}-{uuid.uuid4().hex}"
+		try:
+			os.makedirs(cache, exist_ok=True)
+			with open(temporary, "w", encoding="utf8") as f: json.dump({ "stamps": stamps, "hash": key }, f)
+			os.replace(temporary, index)
+		except OSError: pass # The stamps only save the next run some reading
+		finally:
+			if os.path.exists(temporary): os.remove(temporary)
+	timings["hash"] = timings.get("hash", 0) + time.perf_counter() - start
+	hashes[grammar_dir] = key
+	return key
+
+# Loads the CPPE language, only compiling the grammar if no cached build matches its current sources
+def load_language(grammar_dir: str = GRAMMAR_DIR) -> Language:
+	key = grammar_hash(grammar_dir)
+
+	cache = cache_directory()
+	library = os.path.join(cache, f"cppe-{key[:32]}{LIBRARY_SUFFIX}")
+	start = time.perf_counter()
+	if not os.path.exists(library):
+		os.makedirs(cache, exist_ok=True)
+		# Build somewhere private and then atomically move it into place so concurrent builds never see a partial library
+		temporary = os.path.join(cache, f".cppe-{key[:32]}-{os.getpid()}-{uuid.uuid4().hex}{LIBRARY_SUFFIX}")
+		try:
+			Language.build_library(temporary, [grammar_dir])
+			try: os.replace(temporary, library)
+			except OSError: # Windows refuses to replace a library another process has loaded... which means someone else already built it
+				if not os.path.exists(library): raise
+		finally:
+			if os.path.exists(temporary): os.remove(temporary)
+	timings["build"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	language = Language(library, "cppe")
+	timings["load"] = time.perf_counter() - start
+	return language
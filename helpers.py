@@ -1,4 +1,5 @@
 # Helpers
+import bisect, re
 
 # from: https://stackoverflow.com/questions/2556108/rreplace-how-to-replace-the-last-occurrence-of-an-expression-in-a-string
 def rreplace(s, old, new, occurrence = 1):
@@ -11,13 +12,54 @@ def extract_ending_indent(text: str) -> str:
 	nonSpaceIndex = len(last) - len(last.lstrip())
 	return last[0:nonSpaceIndex]
 
-# Find the index of the given node in its parent
-def index_in_parent(node) -> int:
-	parent = node.parent
-	for i, child in enumerate(parent.children):
-		if child == node:
-			return i
-	return -1
+# A source file that is decoded once, text is then sliced out of it using (tree-sitter) byte offsets
+class SourceBuffer:
+	def __init__(self, raw: bytes):
+		self.raw = raw
+		self.text = raw.decode("utf8")
+		# Byte offset of every non-ASCII character... and how many extra bytes the characters up to (and including) it took
+		self.multibyte = []
+		self.extra = []
+		if len(self.text) != len(raw):
+			extra = 0
+			for match in re.finditer(r"[^\x00-\x7f]", self.text):
+				self.multibyte.append(match.start() + extra)
+				extra += len(match.group(0).encode("utf8")) - 1
+				self.extra.append(extra)
+
+	# Converts a byte offset into an offset into the decoded text
+	def char_offset(self, byte: int) -> int:
+		if len(self.multibyte) == 0: return byte # Pure ASCII, bytes and characters line up!
+		index = bisect.bisect_left(self.multibyte, byte)
+		return byte - (self.extra[index - 1] if index > 0 else 0)
+
+	def __getitem__(self, key: slice) -> str:
+		return self.text[self.char_offset(key.start):self.char_offset(key.stop)]
+
+	def __len__(self) -> int:
+		return len(self.raw)
+
+# Finds the (start, old end, new end) byte range that differs between two versions of a buffer
+def changed_byte_range(old: bytes, new: bytes) -> tuple[int, int, int]:
+	limit = min(len(old), len(new))
+	# Binary searches so the comparisons happen in C instead of one byte at a time in Python
+	low, high = 0, limit
+	while low < high:
+		mid = (low + high + 1) // 2
+		if old[:mid] == new[:mid]: low = mid
+		else: high = mid - 1
+	start = low
+	low, high = 0, limit - start
+	while low < high:
+		mid = (low + high + 1) // 2
+		if old[len(old) - mid:] == new[len(new) - mid:]: low = mid
+		else: high = mid - 1
+	return start, len(old) - low, len(new) - low
+
+# Converts a byte offset into a tree-sitter (row, column) point
+def byte_to_point(raw: bytes, offset: int) -> tuple[int, int]:
+	row = raw.count(b"\n", 0, offset)
+	return row, offset - (raw.rfind(b"\n", 0, offset) + 1)
 
 # Get the parent of the given node (skipping any labeled_expression nodes)
 def skip_labeled_parents(node):
@@ -25,40 +67,138 @@ def skip_labeled_parents(node):
 	while parent.type in ["labeled_expression", "labeled_statement", "possibly_labeled_control_flow_expression"]: parent = parent.parent
 	return parent
 
+# Checks if the given expression node is within an expression
+def in_expression(node) -> bool:
+	parent = skip_labeled_parents(node)
+	if "init_declarator" in parent.type: return True
+	if "expression" not in parent.type: return False
+	if parent.type == "expression_statement": return False #TODO: Are there any cases where this causes issues?
+	if "compound" in parent.type:
+		ret = parent.child_by_field_name("return")
+		return ret == node\
+			or (ret is not None and ret.type in ["labeled_expression", "possibly_labeled_control_flow_expression"]) #TODO: make sure this works
+	return True
+
+# Checks if the translation of the given node wraps its children in a lambda (which a goto can't jump out of)
+def is_lambda_boundary(node) -> bool:
+	match node.type:
+		case "lambda_expression" | "defer_statement": return True
+		case "if_statement" | "switch_statement" | "try_statement" | "for_statement" | "while_statement" | "do_statement" | "for_range_loop":
+			return in_expression(node)
+		case "compound_expression":
+			# Compound expressions are wrapped... unless they are a function's body or the body of a control flow statement
+			parent = node.parent
+			if parent.type in ["function_definition", "lambda_expression"]: return False
+			if parent.type in ["try_statement", "catch_clause"] and parent.child_by_field_name("body") == node: return False
+			if parent.type == "if_statement" and parent.child_by_field_name("consequence") == node: return in_expression(parent)
+			return True
+	return False
+
+# Gets the loop the given expression is (skipping parentheses), if it is an unlabeled loop
+def expression_loop(node):
+	while node.type == "parenthesized_expression" and node.named_child_count == 1: node = node.named_children[0]
+	if node.type == "possibly_labeled_control_flow_expression" and node.child_by_field_name("label") is None: node = node.children[0]
+	return node if node.type in ["for_statement", "while_statement", "do_statement", "for_range_loop"] else None
+
+# Checks if the value of the given expression is thrown away (the left of a comma or cast to void)
+def is_discarded(node, source) -> bool:
+	parent = skip_labeled_parents(node)
+	while parent.type == "parenthesized_expression": node, parent = parent, skip_labeled_parents(parent)
+	if parent.type == "comma_expression": return parent.child_by_field_name("left") == node
+	if parent.type == "cast_expression":
+		type = parent.child_by_field_name("type")
+		return type is not None and source[type.start_byte:type.end_byte].strip() == "void"
+	return False
+
+# Get the label of the given loop (None if it isn't labeled)
+def loop_label(loop, source) -> str | None:
+	parent = loop.parent
+	if parent is None or parent.type not in ["labeled_expression", "labeled_statement", "possibly_labeled_control_flow_expression"]: return None
+	label = parent.child_by_field_name("label")
+	if label is None: return None
+	return source[label.start_byte:label.end_byte].strip()
+
+# Gets the name a declarator declares and how many pointers it adds to the declaration's type
+# NOTE: The pointers are None when the declarator is anything else (an array, a function, a structured binding, ...), the name is then None too
+def declarator_name(declarator, source) -> tuple[str | None, int | None]:
+	pointers = 0
+	while declarator is not None:
+		match declarator.type:
+			case "identifier" | "field_identifier": return source[declarator.start_byte:declarator.end_byte], pointers
+			case "init_declarator": declarator = declarator.child_by_field_name("declarator")
+			case "reference_declarator": declarator = declarator.named_children[-1] if declarator.named_child_count > 0 else None
+			case "pointer_declarator":
+				pointers += 1
+				declarator = declarator.child_by_field_name("declarator")
+			case _: return None, None
+	return None, None
+
+# Every name a declarator could declare (for the declarators declarator_name doesn't understand)
+def declarator_names(declarator, source) -> list[str]:
+	if declarator.type == "init_declarator": declarator = declarator.child_by_field_name("declarator")
+	if declarator is None: return []
+	if declarator.type in ["identifier", "field_identifier"]: return [source[declarator.start_byte:declarator.end_byte]]
+	return [source[node.start_byte:node.end_byte] for node in find_all_in_children(declarator, ["identifier", "field_identifier"])]
+
+# Finds the function_declarator of a function (or lambda) definition, skipping the pointers and references wrapping it
+def function_declarator(definition):
+	declarator = definition.child_by_field_name("declarator")
+	while declarator is not None and declarator.type not in ["function_declarator", "abstract_function_declarator"]:
+		declarator = declarator.child_by_field_name("declarator") or (declarator.named_children[-1] if declarator.type == "reference_declarator" and declarator.named_child_count > 0 else None)
+	return declarator
+
 # Given a node either it returns itself or it returns the node the labeled expression is wrapping!
 def skip_labeled_expression_children(node):
 	while node.type == "labeled_expression":
 		node = node.children[2]
 	return node
 
+# Replaces the first opening brace and the last closing brace in the text (either can be skipped by passing None)
+def replace_braces(text: str, opening: str | None = None, closing: str | None = None) -> str:
+	edits = []
+	if opening is not None and (index := text.find("{")) >= 0: edits.append((index, opening))
+	if closing is not None and (index := text.rfind("}")) >= 0: edits.append((index, closing))
+	out = []
+	start = 0
+	for index, replacement in sorted(edits):
+		out.append(text[start:index])
+		out.append(replacement)
+		start = index + 1
+	out.append(text[start:])
+	return "".join(out)
+
 # Returns the provided string if it exists and had length... or returns the other thing
 def str_or(string: str | None, other):
 	if string is not None and len(string) > 0:
 		return string
 	return other
 
-# Finds a child node of the given types 
-def find_in_children(node, targetTypes: list[str] | str):
+# Walks every node below the given one (in document order) with a cursor, so no lists of children are ever built
+# NOTE: Nodes of the pruned types are still visited... but nothing below them is
+def iterate_descendants(node, prune: list[str] | str | None = None):
+	if prune is None: prune = []
+	elif not isinstance(prune, list): prune = [prune]
+	cursor = node.walk()
+	if not cursor.goto_first_child(): return
+	while True:
+		current = cursor.node
+		yield current
+		if current.type in prune or not cursor.goto_first_child():
+			while not cursor.goto_next_sibling():
+				if not cursor.goto_parent(): return # The cursor can't leave the node it was created from
+
+# Finds the first node of the given types below the given node (stopping as soon as it is found)
+def find_in_children(node, targetTypes: list[str] | str, prune: list[str] | str | None = None):
 	if not isinstance(targetTypes, list): targetTypes = [targetTypes]
-	queue = node.children[:] # Clone it!
-	while len(queue) > 0:
-		if queue[0].type in targetTypes:
-			return queue[0]
-		queue.extend(queue[0].children)
-		queue.pop(0)
+	for descendant in iterate_descendants(node, prune):
+		if descendant.type in targetTypes:
+			return descendant
 	return None
 
-# Finds all child nodes of the given types
-def find_all_in_children(node, targetTypes: list[str] | str):
+# Finds all nodes of the given types below the given node
+def find_all_in_children(node, targetTypes: list[str] | str, prune: list[str] | str | None = None):
 	if not isinstance(targetTypes, list): targetTypes = [targetTypes]
-	found = []
-	queue = node.children[:] # Clone it!
-	while len(queue) > 0:
-		if queue[0].type in targetTypes:
-			found.append(queue[0])
-		queue.extend(queue[0].children)
-		queue.pop(0)
-	return found
+	return [descendant for descendant in iterate_descendants(node, prune) if descendant.type in targetTypes]
 
 # Wraps the output into a lambda if it is not a compound expression (which already wraps into a lambda)!
 def wrap_if_not_compound(out: str, type: str, ret = False):
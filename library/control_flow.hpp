@@ -3,6 +3,17 @@
 
 #include "defer.hpp"
 
+#include <algorithm>
+#include <csetjmp>
+#include <cstddef>
+#include <exception>
+#include <ranges>
+#include <span>
+#include <stdexcept>
+#include <string>
+#include <string_view>
+#include <utility>
+
 #define CPPE_STRINGIFY_IMPL(s) #s
 #define CPPE_STRINGIFY(s) CPPE_STRINGIFY_IMPL(s)
 
@@ -139,6 +150,12 @@ namespace CPPE {
             jump();
         }
     };
+
+    // Reserves room for an element per element of the range (when its size is known without iterating it)
+    template<typename Out, typename Range>
+    inline void reserve_for(Out& out, Range&& range) {
+        if constexpr (std::ranges::sized_range<Range>) out.reserve(std::ranges::size(range));
+    }
 }
 
 
@@ -147,7 +164,9 @@ namespace CPPE {
 
 
 
-#if __cpp_exceptions
+// NOTE: The preprocessor lowers labeled continues/breaks which don't jump out of a lambda to gotos, these only handle the rest...
+// longjmp is far cheaper than throwing but skips the destructors of everything it jumps over, so it is opt in (with CPPE_JUMP_STATE) when exceptions are available
+#if __cpp_exceptions && !defined(CPPE_JUMP_STATE)
 
     #define CPPE_DEFINE_PROPIGATOR_START(LABEL, TYPE, PARENT, DEPTH) try {
     #define CPPE_DEFINE_PROPIGATOR_END(LABEL, TYPE) } catch(::CPPE::Return<TYPE>& r) { return r.value; } catch(::CPPE::BaseCB& cb) { throw ::CPPE::FlowPropigationException("Uncaught Continue/Break with label: " + std::string(cb.label)); }
@@ -161,7 +180,7 @@ namespace CPPE {
     #define CPPE_CONTINUE(LABEL, DEPTH) throw ::CPPE::Continue<CPPE_STRINGIFY(LABEL)>{};
     #define CPPE_BREAK(LABEL, DEPTH) throw ::CPPE::Break<CPPE_STRINGIFY(LABEL)>{};
 
-#else // no __cpp_exceptions
+#else // no __cpp_exceptions (or CPPE_JUMP_STATE)
 
      // NOTE: Can't use goto since we need to jump between functions!
     #define CPPE_DEFINE_PROPIGATOR_START(LABEL, TYPE, PARENT, DEPTH) ::CPPE::JumpState CPPE_propigate_##DEPTH;\
@@ -249,7 +268,7 @@ namespace CPPE {
     #define CPPE_CONTINUE(LABEL, DEPTH) CPPE_propigate_helper_##DEPTH.continue_<CPPE_STRINGIFY(LABEL)>()
     #define CPPE_BREAK(LABEL, DEPTH) CPPE_propigate_helper_##DEPTH.break_<CPPE_STRINGIFY(LABEL)>()
 
-#endif // __cpp_exceptions
+#endif // __cpp_exceptions && !CPPE_JUMP_STATE
 
 #define CPPE_DEFINE_LOOP_PROPIGATOR_AND_HELPER_START(LABEL, TYPE, PARENT, DEPTH)\
     CPPE_DEFINE_LOOP_HELPER_PROPIGATOR(DEPTH)\
@@ -35,6 +35,9 @@
 	}
 */
 
+#include <concepts>
+#include <utility>
+
 // Defer (https://stackoverflow.com/questions/32432450/what-is-standard-defer-finalizer-implementation-in-c && https://www.gingerbill.org/article/2015/08/19/defer-in-cpp/)
 #ifndef defer
 namespace detail {
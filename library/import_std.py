@@ -1,33 +1,74 @@
-import subprocess
+import argparse
 import os
+import shlex
+import subprocess
+import sys
 import urllib.request
 
-def compile_and_run_cpp(source_file_path):
-    # Check if the source file exists
-    if not os.path.exists(source_file_path):
-        print("Error: Source file does not exist.")
-        return -2
+LIBRARY_DIR = os.path.dirname(os.path.abspath(__file__))
+STDCXX_URL = "https://raw.githubusercontent.com/gcc-mirror/gcc/master/libstdc%2B%2B-v3/include/precompiled/stdc%2B%2B.h"
+
+# The modules probe (and its cache) is shared with the translator's --precompile
+sys.path.insert(0, os.path.dirname(LIBRARY_DIR))
+from precompiled import modules_supported
+
+# Finds the bits/stdc++.h which ships with the compiler (None if it doesn't ship one)
+def installed_header(compiler, flags):
+    try:
+        result = subprocess.run([compiler, *flags, "-x", "c++", "-fsyntax-only", "-H", "-"], input="#include <bits/stdc++.h>\n", capture_output=True, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    # -H lists every included header, the first one is the header itself
+    for line in result.stderr.splitlines():
+        if line.startswith(". "):
+            return line[2:].strip()
+    return None
+
+# Reads the header from a local file or a URL
+def read_header(source, offline):
+    if "://" not in source:
+        with open(source) as f:
+            return f.read()
+    if offline:
+        raise RuntimeError(f"Can't download {source} while offline")
+    with urllib.request.urlopen(source) as response:
+        return response.read().decode("utf8")
 
-    # Extract the directory and filename without extension
-    source_directory, source_filename = os.path.split(os.path.abspath(source_file_path))
-    source_filename_no_ext = "".join(os.path.splitext(source_filename)[:-1])
+def main():
+    arg_parser = argparse.ArgumentParser(description="Provides import_std.hpp (which includes all of the standard library) for compilers without modules")
+    arg_parser.add_argument("--compiler", default="g++", help="compiler whose support for modules is checked (defaults to g++)")
+    arg_parser.add_argument("--flags", default="", help="flags the compiler is used with")
+    arg_parser.add_argument("--header", help="local copy (or URL) of stdc++.h to use, otherwise the compiler's own copy is used or one is downloaded")
+    arg_parser.add_argument("--offline", action="store_true", help="never download anything")
+    arg_parser.add_argument("-o", "--output", default=os.path.join(LIBRARY_DIR, "import_std.hpp"), help="where to write the header (defaults to import_std.hpp next to this script)")
+    args = arg_parser.parse_args()
+    flags = shlex.split(args.flags)
 
-    # Compile the C++ source file to create an executable
-    executable_file_path = os.path.join(source_directory, source_filename_no_ext)
+    if modules_supported(args.compiler, flags):
+        print("Modules are supported, import_std.hpp isn't needed.")
+        return 0
+
+    source = args.header or installed_header(args.compiler, flags) or STDCXX_URL
     try:
-        subprocess.run(['g++', source_file_path, '-o', executable_file_path], check=True)
-        print("Compilation successful.")
-    except subprocess.CalledProcessError as e:
-        print("Compilation failed.")
-        return -3
+        content = read_header(source, args.offline)
+    except (OSError, RuntimeError) as e:
+        print(f"Failed to get stdc++.h: {e}", file=sys.stderr)
+        return 1
 
-    # Run the compiled executable
+    # NOTE: The header is only written when it changes... so everything including it isn't needlessly rebuilt
     try:
-        return subprocess.run([executable_file_path]).returncode
-    except subprocess.CalledProcessError as e:
-        print("Execution failed.")
-        return -4
-
-if compile_and_run_cpp("modules_check.cpp") != 0: # The checker returns 0 when modules are supported!
-    urllib.request.urlretrieve("https://raw.githubusercontent.com/gcc-mirror/gcc/master/libstdc%2B%2B-v3/include/precompiled/stdc%2B%2B.h", "import_std.hpp")
-    print("std include header successfully recieved.")
\ No newline at end of file
+        with open(args.output) as f:
+            if f.read() == content:
+                print("import_std.hpp is up to date.")
+                return 0
+    except OSError:
+        pass
+    with open(args.output, "w") as f:
+        f.write(content)
+    print(f"std include header successfully recieved (from {source}).")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
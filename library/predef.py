@@ -1,30 +1,122 @@
 from pathlib import Path
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import shutil
 import subprocess
+import sys
+import tarfile
+import tempfile
+import urllib.request
+import zipfile
 
-# Download Boost.Predef
-subprocess.run(["svn", "export", "https://github.com/boostorg/predef/trunk/include/boost", "--force"])
-print("did it work?")
+LIBRARY_DIR = os.path.dirname(os.path.abspath(__file__))
+SVN_URL = "https://github.com/boostorg/predef/trunk/include/boost"
 
-# Add extra std and no prefix defines
-for path in Path('boost').rglob('*.h'):
-    f = open(path, "r").read().split("\n")
-    content = ""
+sys.path.insert(0, os.path.dirname(LIBRARY_DIR))
+from grammar import cache_directory
 
+# Downloads the archive at the URL (only once, later runs reuse the cached copy)
+def download(url, offline):
+    name = url.rstrip("/").split("/")[-1]
+    path = os.path.join(cache_directory(), "downloads", hashlib.sha256(url.encode("utf8")).hexdigest()[:32], name)
+    if os.path.exists(path):
+        return path
+    if offline:
+        raise RuntimeError(f"Can't download {url} while offline (and it isn't cached)")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    urllib.request.urlretrieve(url, temporary)
+    os.replace(temporary, path)
+    return path
+
+# Finds the boost directory (the one holding predef.h) below the given directory
+def find_boost(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        if os.path.basename(root) == "boost" and "predef.h" in files:
+            return root
+    raise RuntimeError(f"Failed to find boost/predef.h in {directory}")
+
+# Copies Boost.Predef from a directory, a (zip or tar) archive, or an archive's URL into the output
+def fetch(source, output, offline):
+    if "://" in source:
+        source = download(source, offline)
+    if os.path.isdir(source):
+        boost = find_boost(source)
+        if os.path.abspath(boost) != os.path.abspath(output):
+            shutil.copytree(boost, output, dirs_exist_ok=True)
+        return
+    with tempfile.TemporaryDirectory(prefix="cppe-") as directory:
+        if zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as archive:
+                archive.extractall(directory)
+        else:
+            with tarfile.open(source) as archive:
+                archive.extractall(directory, filter="data")
+        shutil.copytree(find_boost(directory), output, dirs_exist_ok=True)
+
+# Adds a copy of every BOOST_ define and undef without the prefix (and reports whether anything was added)
+# NOTE: Copies which are already there aren't added again, so running this over rewritten headers changes nothing
+def rewrite(text):
+    lines = text.split("\n")
+    out = []
     i = 0
-    while i < len(f):
-        line = f[i]
-        if("#" in line):
-            while i + 1 < len(f) and f[i].strip().endswith("\\"):
+    while i < len(lines):
+        line = lines[i]
+        if "#" in line:
+            while i + 1 < len(lines) and lines[i].strip().endswith("\\"):
                 i += 1
-                line += "\n" + f[i]
-
-        content += line + "\n"
+                line += "\n" + lines[i]
+        out.append(line)
+        i += 1
 
         if "#" in line and ("define " in line or "undef " in line) and "BOOST_" in line:
-            content += line.replace("BOOST_", "") + "\n"
-        i += 1
+            copy = line.replace("BOOST_", "")
+            if "\n".join(lines[i:i + copy.count("\n") + 1]) != copy:
+                out.append(copy)
+    return "\n".join(out)
+
+def process(path):
+    with open(path) as f:
+        text = f.read()
+    content = rewrite(text)
+    if content == text:
+        return False
+    with open(path, "w") as f:
+        f.write(content)
+    return True
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Provides Boost.Predef (with unprefixed copies of its defines) for the CPPE library")
+    arg_parser.add_argument("--source", help="directory, archive (.zip or .tar.*), or URL of an archive holding boost/predef.h (defaults to exporting it with svn, or the existing copy when offline)")
+    arg_parser.add_argument("--offline", action="store_true", help="never download anything")
+    arg_parser.add_argument("-o", "--output", default=os.path.join(LIBRARY_DIR, "boost"), help="where to put the boost directory (defaults to the one next to this script)")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=0, help="number of processes to rewrite the headers with (defaults to the number of CPUs)")
+    args = arg_parser.parse_args()
+
+    try:
+        if args.source is not None:
+            fetch(args.source, args.output, args.offline)
+        elif not args.offline:
+            subprocess.run(["svn", "export", SVN_URL, args.output, "--force"], check=True)
+        elif not os.path.exists(os.path.join(args.output, "predef.h")):
+            raise RuntimeError(f"There is no copy of Boost.Predef in {args.output} to use while offline")
+    except (OSError, RuntimeError, subprocess.CalledProcessError, zipfile.BadZipFile, tarfile.TarError) as e:
+        print(f"Failed to get Boost.Predef: {e}", file=sys.stderr)
+        return 1
+
+    # Add extra std and no prefix defines
+    paths = sorted(Path(args.output).rglob('*.h'))
+    jobs = max(min(args.jobs if args.jobs > 0 else os.cpu_count() or 1, len(paths)), 1)
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(process, paths, chunksize=16))
+    else:
+        results = [process(path) for path in paths]
+    print(f"Processed {sum(results)} headers ({len(paths) - sum(results)} were already processed).")
+    return 0
 
-    f = open(path, "w")
-    f.write(content)
-    print("Proccessed: ", path)
-    f.close()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,12 @@
 
 #include <variant>
 #include <span>
+#include <array>
+#include <string>
+#include <tuple>
+#include <type_traits>
+#include <utility>
+#include <vector>
 
 namespace CPPE {
 	template<typename... Ts>
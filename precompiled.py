@@ -0,0 +1,125 @@
+from grammar import cache_directory
+import hashlib, json, os, shutil, subprocess, sys, tempfile, uuid
+
+MODULES_CHECK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "library", "modules_check.cpp")
+
+# A precompiled copy of the CPPE library: outputs include `header` (in place of the library itself) and are compiled with `flags` added
+class Precompiled:
+	def __init__(self, kind: str, header: str, flags: list[str]):
+		self.kind = kind # "pch" or "header-unit"
+		self.header = header
+		self.flags = flags
+
+def compiler_version(compiler: str) -> str:
+	try: return subprocess.run([compiler, "--version"], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError) as e:
+		raise RuntimeError(f"Failed to run the compiler {compiler}: {e}")
+
+# Hash of everything that influences the precompiled library: the library's headers, the compiler, and the flags it is compiled with
+def precompiled_hash(library: str, compiler: str, flags: list[str]) -> str:
+	h = hashlib.sha256()
+	h.update(f"{compiler_version(compiler)}\0{sys.platform}\0".encode("utf8"))
+	h.update("\0".join(flags).encode("utf8") + b"\0")
+	directory = os.path.dirname(library)
+	for root, dirs, files in os.walk(directory):
+		dirs.sort() # Make sure the walk order (and thus the hash) is stable
+		for name in sorted(files):
+			if os.path.splitext(name)[1] not in [".h", ".hpp"]: continue
+			path = os.path.join(root, name)
+			h.update(os.path.relpath(path, directory).replace(os.sep, "/").encode("utf8") + b"\0")
+			with open(path, "rb") as f:
+				h.update(f.read())
+	return h.hexdigest()
+
+# Compiles and runs modules_check.cpp with the given compiler and flags (it exits with 0 when modules are supported)
+# NOTE: The result is cached per compiler (path and version), flags, and version of the check
+def modules_supported(compiler: str, flags: list[str]) -> bool:
+	probes = os.path.join(cache_directory(), "probes.json")
+	try:
+		with open(MODULES_CHECK, "rb") as f:
+			check = hashlib.sha256(f.read()).hexdigest()
+		key = hashlib.sha256("\0".join([shutil.which(compiler) or compiler, compiler_version(compiler), check, *flags]).encode("utf8")).hexdigest()
+	except (OSError, RuntimeError): return False
+	try:
+		with open(probes) as f:
+			cached = json.load(f)
+	except (OSError, ValueError): cached = {}
+	if isinstance(cached.get(key), bool): return cached[key]
+
+	with tempfile.TemporaryDirectory(prefix="cppe-") as directory:
+		executable = os.path.join(directory, "modules_check")
+		try:
+			supported = subprocess.run([compiler, *flags, MODULES_CHECK, "-o", executable], capture_output=True).returncode == 0\
+				and subprocess.run([executable], capture_output=True).returncode == 0
+		except OSError: return False # Not cached, the compiler might just be missing for now
+
+	# NOTE: Concurrent probes can drop each other's results... which just means probing again later
+	os.makedirs(os.path.dirname(probes), exist_ok=True)
+	temporary = f"{probes}.{os.getpid()}-{uuid.uuid4().hex}.tmp"
+	with open(temporary, "w") as f:
+		json.dump(cached | { key: supported }, f, indent="\t")
+	os.replace(temporary, probes)
+	return supported
+
+def run_compiler(command: list[str], cwd: str | None = None):
+	result = subprocess.run(command, capture_output=True, text=True, cwd=cwd)
+	if result.returncode != 0:
+		raise RuntimeError(f"Failed to precompile the CPPE library ({' '.join(command)}):\n{result.stderr}")
+
+# Precompiles the library as a PCH next to the header, returning the flags the outputs need to use it
+def build_pch(header: str, compiler: str, flags: list[str], clang: bool) -> list[str]:
+	# GCC picks up header.gch automatically... clang has to be told about its PCH
+	pch = header + (".pch" if clang else ".gch")
+	temporary = f"{pch}.{os.getpid()}-{uuid.uuid4().hex}"
+	try:
+		run_compiler([compiler, *flags, "-x", "c++-header", header, "-o", temporary])
+		os.replace(temporary, pch)
+	finally:
+		if os.path.exists(temporary): os.remove(temporary)
+	return ["-include-pch", pch] if clang else ["-Winvalid-pch"]
+
+# Compiles the library into a (GCC) header unit, which #includes of it are then translated into imports of
+def build_header_unit(header: str, compiler: str, flags: list[str]) -> list[str]:
+	directory = os.path.dirname(header)
+	run_compiler([compiler, *flags, "-fmodules-ts", "-x", "c++-header", header], cwd=directory)
+	units = [os.path.join(root, name) for root, _, files in os.walk(os.path.join(directory, "gcm.cache")) for name in files if name.endswith(".gcm")]
+	if len(units) != 1: raise RuntimeError(f"Failed to find the header unit built for {header}")
+	mapper = os.path.join(directory, "module.map")
+	with open(mapper, "w") as f:
+		f.write(f"{header} {units[0]}\n")
+	return ["-fmodules-ts", f"-fmodule-mapper={mapper}"]
+
+# Builds (or finds the cached) precompiled library for the given compiler and flags
+# NOTE: The outputs must be compiled with exactly the same flags for the compiler to accept what was precompiled
+def precompile(library: str, compiler: str = "c++", flags: list[str] | None = None) -> Precompiled:
+	flags = list(flags or [])
+	key = precompiled_hash(library, compiler, flags)
+	directory = os.path.join(cache_directory(), "precompiled", key[:32])
+	header = os.path.join(directory, "CPPE.hpp")
+	description = os.path.join(directory, "precompiled.json")
+	try:
+		with open(description) as f:
+			cached = json.load(f)
+		return Precompiled(cached["kind"], header, cached["flags"])
+	except (OSError, ValueError, KeyError): pass # Not built yet (or interrupted part way through)
+
+	os.makedirs(directory, exist_ok=True)
+	# The header which gets precompiled simply includes the real library (so its relative includes still work)
+	with open(header, "w") as f:
+		f.write(f'#include "{os.path.abspath(library)}"\n')
+
+	clang = "clang" in compiler_version(compiler).lower()
+	kind = "pch"
+	if not clang and modules_supported(compiler, flags):
+		try:
+			outputFlags = build_header_unit(header, compiler, flags)
+			kind = "header-unit"
+		except RuntimeError: pass # Fall back to a PCH
+	if kind == "pch": outputFlags = build_pch(header, compiler, flags, clang)
+
+	# Only recorded once everything is in place, so concurrent or interrupted builds are never mistaken for finished ones
+	temporary = f"{description}.{os.getpid()}.tmp"
+	with open(temporary, "w") as f:
+		json.dump({ "kind": kind, "flags": outputFlags, "compiler": compiler, "compiler_flags": flags }, f, indent="\t")
+	os.replace(temporary, description)
+	return Precompiled(kind, header, outputFlags)
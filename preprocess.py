@@ -1,57 +1,561 @@
+import time
+startupStart = time.perf_counter()
 from tree_sitter import Language, Parser
 from helpers import *
+from grammar import GRAMMAR_DIR, load_language
+from profiler import Profiler
+from precompiled import precompile
+from translation_cache import TranslationCache, DEFAULT_MAX_SIZE, LIBRARY_PLACEHOLDER, library_hash, parse_size, relocate
+import grammar
 import ast
-import copy
-import argparse, os
+import argparse, collections, concurrent.futures, filecmp, glob, hashlib, io, json, os, re, shlex, shutil, sys, tempfile, traceback, typing
+import helpers
+importTime = time.perf_counter() - startupStart
 
-parser = argparse.ArgumentParser(
+DEFAULT_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "library", "CPPE.hpp")
+
+arg_parser = argparse.ArgumentParser(
                     prog='CPPE Preprocessor',
                     description='Converts CPPE files into C++ files')
-parser.add_argument("filename")
-parser.add_argument("-o", "--output", required=False)					
-parser.add_argument("-l", "--library", default=os.path.join(os.path.dirname(__file__), "library", "CPPE.hpp"))
-parser.add_argument("-p", "--print", action='store_true')
-args = parser.parse_args()
-library = os.path.abspath(args.library)
-if "CPPE.hpp" not in library: library = os.path.join(library, "CPPE.hpp")
-filedir = os.path.dirname(os.path.abspath(args.filename))
-filename = os.path.basename(args.filename)
-target = args.output
-if target is None and not args.print: target = os.path.join(filedir, filename.replace(".cppe", ".cpp").replace(".hppe", ".hpp"))
-
-
-Language.build_library(
-	# Store the library in the `build` directory
-	'build/cppe.so',
-
-	# Include one or more languages
-	[
-		'tree-sitter-cppe',
-	]
-)
-
-language = Language('build/cppe.so', 'cppe')
-
-prototypes = []
-
-parser = Parser()
-parser.set_language(language)
-
-tree = None
-raw = None
-with open(args.filename) as f:
-	raw = f.read().encode("utf8")
-	tree = parser.parse(raw)
+arg_parser.add_argument("filenames", nargs="+", help="files, globs, or directories (searched recursively for .cppe/.hppe files) to translate")
+arg_parser.add_argument("-o", "--output", required=False, help="output file (when translating a single file) or the root of a mirrored output tree")
+arg_parser.add_argument("-l", "--library", default=DEFAULT_LIBRARY)
+arg_parser.add_argument("-p", "--print", action='store_true')
+arg_parser.add_argument("-g", "--grammar", default=GRAMMAR_DIR)
+arg_parser.add_argument("-j", "--jobs", type=int, default=1, help="number of files to translate in parallel (0 uses every core)")
+arg_parser.add_argument("-f", "--force", action='store_true', help="translate every file, even if its manifest says it is up to date")
+arg_parser.add_argument("-w", "--watch", action='store_true', help="keep running and retranslate files as they change")
+arg_parser.add_argument("--interval", type=float, default=0.2, help="seconds between checks for changes in watch mode")
+arg_parser.add_argument("--profile", nargs="?", const="table", choices=["table", "json", "chrome"], help="record where translation time is spent per node type")
+arg_parser.add_argument("--profile-output", help="file to write the profile to (defaults to stderr for tables)")
+arg_parser.add_argument("--precompile", metavar="COMMAND", help="compiler command (with flags) the outputs will be compiled with, a precompiled copy of the library is built (and cached) for it and included instead")
+arg_parser.add_argument("--header", help="write the prototypes of every translated file into this shared header (which each output includes) rather than into each output")
+arg_parser.add_argument("--minimal-includes", action='store_true', help="include only the parts of the library (and the standard headers) each output uses, rather than the whole library (sources mustn't rely on anything else it brings in)")
+arg_parser.add_argument("--cache", default=os.environ.get("CPPE_TRANSLATION_CACHE"), help="directory (local or a shared mount) to share translations through, keyed by the source and everything else they depend on (defaults to $CPPE_TRANSLATION_CACHE)")
+arg_parser.add_argument("--cache-size", default=os.environ.get("CPPE_TRANSLATION_CACHE_SIZE", str(DEFAULT_MAX_SIZE)), help="size (like 500M or 2G) the cache is trimmed to, least recently used translations first")
+arg_parser.add_argument("-t", "--timings", action='store_true', help="print a breakdown of where startup time was spent")
+
+__version__ = "0.1.0"
+SOURCE_EXTENSIONS = [".cppe", ".hppe"]
+MANIFEST_NAME = ".cppe-manifest.json"
+
+# Prototypes in the order they were first declared... with each one only kept once (no matter how it was formatted)
+class PrototypeTable:
+	def __init__(self):
+		self.prototypes = {} # Normalized signature -> prototype
+		self.added = [] # Every prototype ever added (duplicates included), so callers can tell what a piece of processing added
+
+	def add(self, prototype: str):
+		self.added.append(prototype)
+		self.prototypes.setdefault(" ".join(prototype.split()), prototype)
+
+	def extend(self, prototypes: typing.Iterable[str]):
+		for prototype in prototypes: self.add(prototype)
+
+	def __iter__(self):
+		return iter(self.prototypes.values())
+
+	def __len__(self):
+		return len(self.prototypes)
+
+# State that belongs to a single file being translated
+class TranslationUnit:
+	def __init__(self, raw: bytes, tree = None):
+		self.raw = raw
+		self.source = SourceBuffer(raw) # NOTE: Text should be sliced from here rather than decoded from raw
+		self.tree = tree
+		self.prototypes = PrototypeTable()
+		self.memo = {} # Translation of every node already processed (see process)
+		self.statistics = collections.Counter()
+		self.features = set() # Headers the translation needs (see use)
+		self.resolutions = 0 # How many times the symbols were consulted (see resolve_ufcs)
+		self._index = None
+		self._symbols = None
+
+	# Records that the translation relies on the given library ("ufcs.hpp") or standard ("<vector>") headers
+	def use(self, *headers: str):
+		self.features.update(headers)
+
+	# Built the first time a handler needs it
+	@property
+	def index(self):
+		if self._index is None: self._index = TreeIndex(self.tree.root_node, self.source)
+		return self._index
+
+	@property
+	def symbols(self):
+		if self._symbols is None: self._symbols = SymbolTable(self.tree.root_node, self.index, self.source)
+		return self._symbols
+
+	# How the UFCS call (or property) resolves, see SymbolTable.resolve_ufcs
+	def resolve_ufcs(self, argument, function, onPointer: bool, arguments = None) -> str | None:
+		self.resolutions += 1
+		resolution = self.symbols.resolve_ufcs(argument, function, onPointer, arguments)
+		self.statistics["ufcs resolved" if resolution is not None else "ufcs macros"] += 1
+		return resolution
+
+FUNCTION_TYPES = ["function_definition", "inline_method_definition", "operator_cast_definition", "lambda_expression"]
+CLASS_TYPES = ["struct_specifier", "class_specifier", "union_specifier"]
+TYPE_DEFINITION_TYPES = [*CLASS_TYPES, "enum_specifier", "alias_declaration", "type_definition", "type_parameter_declaration", "optional_type_parameter_declaration",
+	"variadic_type_parameter_declaration", "template_template_parameter_declaration"]
+LOOP_TYPES = ["for_statement", "while_statement", "do_statement", "for_range_loop"]
+
+# Facts about a tree gathered in a single pass over it... so handlers don't have to search subtrees (or their own output) to make decisions
+class TreeIndex:
+	def __init__(self, root, source: SourceBuffer):
+		self.expression_returns = set() # Ids of the functions (and lambdas) which directly contain returns from within expressions
+		self.targeted_labels = {} # Loop id -> labels targeted by the breaks/continues anywhere within it
+		self.jump_targets = {} # Labeled break/continue id -> id of the loop it jumps to
+		self.jump_kinds = {} # Loop id -> which of "break" and "continue" jump to it
+		self.propigated_loops = set() # Ids of the loops which some break/continue can only reach by propigating out of a lambda
+		self.rewritten = set() # Ids of the nodes with something below them (or themselves) which translates into anything but its own text
+		self.types = {} # Type name -> every class defined with it (and None for anything else which defines or aliases it, see SymbolTable)
+		functions = [] # Ids of the functions and loops enclosing the current node
+		loops = []
+		kinds = [] # Which (if either) of the above each node between the root and the cursor was pushed onto
+		path = [] # Ids of every node between the root and the cursor
+
+		def leave():
+			path.pop()
+			match kinds.pop():
+				case "function": functions.pop()
+				case "loop": loops.pop()
+
+		cursor = root.walk()
+		while True:
+			node = cursor.node
+			type = node.type
+			path.append(node.id)
+			if type in HANDLERS and rewrites(node, source):
+				for id in reversed(path):
+					if id in self.rewritten: break # ...and so is everything above it
+					self.rewritten.add(id)
+
+			if type == "return_statement":
+				if len(functions) > 0 and node.parent is not None and node.parent.parent is not None and in_expression(node.parent.parent):
+					self.expression_returns.add(functions[-1])
+			elif type in ["break_statement", "continue_statement"]:
+				label = node.child_by_field_name("label")
+				if label is not None:
+					label = source[label.start_byte:label.end_byte].strip()
+					for loop in loops: self.targeted_labels[loop].add(label)
+					self.record_jump(node, label, source)
+			elif type in TYPE_DEFINITION_TYPES: self.record_type(node, source)
+
+			if type in FUNCTION_TYPES:
+				functions.append(node.id)
+				kinds.append("function")
+			elif type in LOOP_TYPES:
+				loops.append(node.id)
+				self.targeted_labels[node.id] = set()
+				kinds.append("loop")
+			else: kinds.append(None)
+
+			if cursor.goto_first_child(): continue
+			leave()
+			while not cursor.goto_next_sibling():
+				if not cursor.goto_parent(): return
+				leave()
+
+	# Finds the loop a labeled break/continue jumps to... noting whether it can get there with a goto or has to propigate out of lambdas
+	def record_jump(self, jump, label: str, source: SourceBuffer):
+		crossesLambda = False
+		ancestor = jump.parent
+		while ancestor is not None:
+			if ancestor.type in LOOP_TYPES and loop_label(ancestor, source) == label:
+				self.jump_targets[jump.id] = ancestor.id
+				self.jump_kinds.setdefault(ancestor.id, set()).add(jump.type.removesuffix("_statement"))
+				if crossesLambda or in_expression(ancestor): # NOTE: The bodies of expression loops are lambdas themselves
+					self.propigated_loops.add(ancestor.id)
+				return
+			crossesLambda = crossesLambda or is_lambda_boundary(ancestor)
+			ancestor = ancestor.parent
+
+	def record_type(self, node, source: SourceBuffer):
+		if node.type in CLASS_TYPES:
+			name = node.child_by_field_name("name")
+			if name is None or name.type != "type_identifier" or node.child_by_field_name("body") is None: return # Anonymous, specialized, or only declared
+			self.types.setdefault(source[name.start_byte:name.end_byte], []).append(node)
+		else: # NOTE: Every type name involved is treated as shadowed... which is conservative, but always safe
+			for name in find_all_in_children(node, "type_identifier"):
+				self.types.setdefault(source[name.start_byte:name.end_byte], []).append(None)
+
+	# Checks if the node translates into exactly its own text (so it can be copied rather than processed)
+	def is_verbatim(self, node) -> bool:
+		return node.id not in self.rewritten
+
+	def has_expression_returns(self, function) -> bool:
+		return function.id in self.expression_returns
+
+	def is_label_targeted(self, loop, label: str) -> bool:
+		return label.strip() in self.targeted_labels.get(loop.id, ())
+
+	# Checks if every labeled break/continue to the loop can simply goto it
+	def jumps_with_goto(self, loop) -> bool:
+		return loop.id in self.jump_kinds and loop.id not in self.propigated_loops
+
+	# Checks if the given labeled break/continue is a goto (see jumps_with_goto)
+	def is_goto(self, jump) -> bool:
+		target = self.jump_targets.get(jump.id)
+		return target is not None and target not in self.propigated_loops
+
+	def kinds_of_jumps_to(self, loop) -> set[str]:
+		return self.jump_kinds.get(loop.id, set())
+
+# Checks if the handler of the given node could translate it into anything but its own text (when everything below it is left alone)
+# NOTE: Being conservative is always safe, the node is then just processed as usual
+def rewrites(node, source: SourceBuffer) -> bool:
+	match node.type:
+		case "return_statement":
+			context = node.parent.parent if node.parent is not None else None
+			return context is None or context.parent is None or in_expression(context)
+		case "break_statement" | "continue_statement" | "case_statement":
+			return node.child_by_field_name("label" if node.type != "case_statement" else "expression") is not None
+		case "for_statement" | "while_statement" | "do_statement" | "switch_statement":
+			return in_expression(node) # Unlabeled loops (and switches) are only rewritten in expressions
+		case "if_statement":
+			consequence = node.child_by_field_name("consequence")
+			return in_expression(node) or consequence is None or consequence.type == "compound_expression"
+		case "try_statement" | "catch_clause":
+			body = node.child_by_field_name("body")
+			return (node.type == "try_statement" and in_expression(node)) or body is None or body.type == "compound_expression"
+		case "for_range_loop":
+			children = node.children
+			if in_expression(node) or len(children) < 6: return True
+			inNode = children[4 if len(children) <= 8 else 5] # See process_range_for
+			return source[children[0].start_byte:children[0].end_byte] == "foreach" or source[inNode.start_byte:inNode.end_byte] == "in"
+		case "labeled_statement":
+			return node.child_count < 3 or node.children[2].type in ["compound_expression", *LOOP_TYPES]
+	return True
+
+# The name of the class a declaration's type names (None if it isn't simply a class's name)
+def class_name(type, source: SourceBuffer) -> str | None:
+	if type is not None and type.type in CLASS_TYPES: type = type.child_by_field_name("name")
+	if type is None or type.type != "type_identifier": return None
+	return source[type.start_byte:type.end_byte]
+
+# Whether a declaration's specifiers make what it declares (or what its pointers point to) const... None when it is volatile (nothing is certain then)
+def declaration_const(declaration, source: SourceBuffer) -> bool | None:
+	const = False
+	for child in declaration.children:
+		if child.type != "type_qualifier": continue
+		qualifier = source[child.start_byte:child.end_byte].strip()
+		if qualifier == "volatile": return None
+		const = const or qualifier in ["const", "constexpr"]
+	return const
+
+# The type (class name, number of pointers, whether the class is const) of the variable declared by a declarator (None if that isn't certain)
+def declared_type(declaration, declarator, source: SourceBuffer) -> tuple[str, int, bool] | None:
+	type = class_name(declaration.child_by_field_name("type"), source)
+	const = declaration_const(declaration, source)
+	pointers = declarator_name(declarator, source)[1]
+	if type is None or const is None or pointers is None: return None
+	return type, pointers, const
+
+# The members of a class defined in the file (see SymbolTable)
+class ClassMembers:
+	def __init__(self, node, source: SourceBuffer):
+		self.node = node
+		self.fields = {} # Name -> type of the field (see declared_type)
+		self.methods = {} # Name -> (number of parameters, whether it is const) of each overload... None when calls to it aren't certain (default or variadic parameters, templates, ...)
+		self.hidden = set() # Names of the members which aren't public (calls to them fall back to the free functions)
+		self.mutable = set()
+		self.friends = set() # Free functions declared as friends (which argument dependent lookup finds)
+		self.closed = not any(child.type == "base_class_clause" for child in node.children) # Whether every member the class has is known
+		access = "private" if node.type == "class_specifier" else "public"
+		for member in node.child_by_field_name("body").named_children:
+			declared = []
+			match member.type:
+				case "access_specifier": access = source[member.start_byte:member.end_byte].strip().rstrip(":").strip()
+				case "field_declaration" | "declaration":
+					for declarator in member.children_by_field_name("declarator"):
+						name, pointers = declarator_name(declarator, source)
+						if pointers is not None:
+							self.fields[name] = declared_type(member, declarator, source)
+							if any(child.type == "storage_class_specifier" and source[child.start_byte:child.end_byte].strip() == "mutable" for child in member.children): self.mutable.add(name)
+							declared.append(name)
+						elif (function := self.method_name(declarator, source)) is not None:
+							self.methods.setdefault(function, []).append(self.signature(declarator, source))
+							declared.append(function)
+						else:
+							for name in declarator_names(declarator, source): self.fields[name] = None
+							declared.extend(declarator_names(declarator, source))
+				case "function_definition" | "inline_method_definition" | "operator_cast_definition":
+					declarator = member.child_by_field_name("declarator")
+					if (function := self.method_name(declarator, source)) is not None:
+						self.methods.setdefault(function, []).append(self.signature(declarator, source))
+						declared.append(function)
+				case "template_declaration":
+					definition = member.named_children[-1]
+					function = self.method_name(definition.child_by_field_name("declarator"), source) if definition.type in ["declaration", "field_declaration", *FUNCTION_TYPES] else None
+					if function is not None:
+						self.methods.setdefault(function, []).append(None)
+						declared.append(function)
+					else: self.closed = False
+				case "friend_declaration":
+					for definition in member.named_children:
+						if definition.type in ["declaration", *FUNCTION_TYPES]:
+							for declarator in definition.children_by_field_name("declarator"):
+								if (function := self.method_name(declarator, source)) is not None: self.friends.add(function)
+				case "static_assert_declaration" | "comment" | "enum_specifier" | "alias_declaration" | "type_definition" | "struct_specifier" | "class_specifier" | "union_specifier": pass
+				case _: self.closed = False # using declarations, macros, errors...
+			if access != "public": self.hidden.update(declared)
+
+	@staticmethod
+	def method_name(declarator, source: SourceBuffer) -> str | None:
+		declarator = ClassMembers.unwrap(declarator)
+		if declarator is None or declarator.type != "function_declarator": return None
+		return declarator_name(declarator.child_by_field_name("declarator"), source)[0]
+
+	@staticmethod
+	def unwrap(declarator):
+		while declarator is not None and declarator.type in ["pointer_declarator", "reference_declarator"]: # The function returns a pointer or reference
+			declarator = declarator.child_by_field_name("declarator") or declarator.named_children[-1]
+		return declarator
+
+	# The (number of parameters, whether it is const) of a method... None when a call's arguments don't simply line up with its parameters
+	@staticmethod
+	def signature(declarator, source: SourceBuffer) -> tuple[int, bool] | None:
+		declarator = ClassMembers.unwrap(declarator)
+		parameters = declarator.child_by_field_name("parameters")
+		if parameters is None or any(child.type == "..." for child in parameters.children): return None
+		count = 0
+		for parameter in parameters.named_children:
+			if parameter.type == "comment": continue
+			if parameter.type != "parameter_declaration": return None # Default values, packs...
+			if parameter.child_by_field_name("declarator") is None and source[parameter.start_byte:parameter.end_byte].strip() == "void": continue
+			count += 1
+		const = False
+		for child in declarator.children:
+			if child.type == "ref_qualifier": return None
+			if child.type == "type_qualifier":
+				qualifier = source[child.start_byte:child.end_byte].strip()
+				if qualifier == "volatile": return None
+				const = const or qualifier == "const"
+		return count, const
+
+	# Checks if obj.name(arguments...) certainly calls the member (rather than the macros falling back to a free function)
+	def calls_method(self, name: str, arguments: int, const: bool) -> bool:
+		signatures = self.methods.get(name)
+		if signatures is None or len(signatures) != 1 or signatures[0] is None or name in self.hidden: return False
+		count, isConst = signatures[0]
+		return count == arguments and (isConst or not const)
+
+	# The type of obj.name (see declared_type), None unless it is certainly that public field (or any field, from within the class)
+	def field_type(self, name: str, const: bool, hidden: bool = False) -> tuple[str, int, bool] | None:
+		type = self.fields.get(name)
+		if type is None or (name in self.hidden and not hidden): return None
+		if type[1] == 0 and const and name not in self.mutable: return type[0], 0, True # The fields of a const object are const too
+		return type
+
+	def description(self) -> dict:
+		return { "fields": sorted(self.fields.items(), key=lambda field: field[0]), "methods": sorted(self.methods.items(), key=lambda method: method[0]),
+			"hidden": sorted(self.hidden), "mutable": sorted(self.mutable), "friends": sorted(self.friends), "closed": self.closed }
+
+# What a file's declarations say about the types of its variables... enough to tell how some UFCS calls resolve without waiting for the C++ compiler (see resolve_ufcs)
+# NOTE: Only classes defined once (at namespace scope, outside of any template) and variables declared as exactly them (or pointers and references to them) are understood
+class SymbolTable:
+	def __init__(self, root, index: TreeIndex, source: SourceBuffer):
+		self.source = source
+		self.classes = {} # Name -> ClassMembers
+		for name, definitions in index.types.items():
+			if len(definitions) != 1 or definitions[0] is None: continue
+			parent = definitions[0].parent
+			if parent is not None and parent.type == "declaration": parent = parent.parent # struct S { ... } s;
+			if parent is not None and parent.type == "translation_unit": self.classes[name] = ClassMembers(definitions[0], source)
+
+		self.functions = set() # Names of the free functions declared at namespace scope
+		self.globals = {} # Name -> type of the variables declared at namespace scope
+		for child in root.named_children:
+			if child.type == "template_declaration" and child.named_child_count > 0:
+				child = child.named_children[-1]
+				if child.type not in FUNCTION_TYPES and child.type != "declaration": continue
+			if child.type in FUNCTION_TYPES:
+				if (function := ClassMembers.method_name(child.child_by_field_name("declarator"), source)) is not None: self.functions.add(function)
+			elif child.type == "declaration":
+				for declarator in child.children_by_field_name("declarator"):
+					if (function := ClassMembers.method_name(declarator, source)) is not None:
+						self.functions.add(function)
+						continue
+					name = declarator_name(declarator, source)[0]
+					names = [name] if name is not None else declarator_names(declarator, source)
+					for name in names:
+						variable = declared_type(child, declarator, source)
+						self.globals[name] = variable if self.globals.get(name, variable) == variable else None
+		self.functions.update(*(members.friends for members in self.classes.values()))
+		for name in self.functions & self.globals.keys(): self.globals[name] = None
+		self.names = set(self.functions).union(*(members.fields.keys() | members.methods.keys() for members in self.classes.values())) # Everything a call could resolve to
+
+		# NOTE: Only a file which includes (and imports) nothing is known in full, a header could declare more free functions (or a CPPE_operator_forward) of its own
+		self.complete = re.search(rb"^[ \t]*(#[ \t]*include|(export[ \t]+)?import)\b", source.raw, re.MULTILINE) is None
+		self.forwarding = not self.complete or b"CPPE_operator_forward" in source.raw # Anything the compiler can't find is forwarded to CPPE_operator_forward... so only members are certain
+		self.scopes = {} # Node id -> name -> (start byte, type) of every variable the node declares (see declarations)
+		self._fingerprint = None
+
+	# Everything resolutions depend on outside of the declaration they are in (so translations which used it can tell when it changed)
+	@property
+	def fingerprint(self) -> str:
+		if self._fingerprint is None:
+			description = { "classes": { name: members.description() for name, members in self.classes.items() }, "functions": sorted(self.functions),
+				"globals": sorted(self.globals.items(), key=lambda variable: variable[0]), "complete": self.complete, "forwarding": self.forwarding }
+			self._fingerprint = hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf8")).hexdigest()
+		return self._fingerprint
+
+	def members_of(self, node) -> ClassMembers | None:
+		members = self.classes.get(class_name(node, self.source))
+		return members if members is not None and members.node.id == node.id else None
+
+	# The variables declared directly by the given node (function parameters, a block's declarations, an if's initializer, ...)
+	def declarations(self, node) -> dict[str, list[tuple[int, tuple[str, int, bool] | None]]]:
+		if node.id in self.scopes: return self.scopes[node.id]
+		source = self.source
+		declared = {}
+		def add(declaration, start: int):
+			for declarator in declaration.children_by_field_name("declarator"):
+				name = declarator_name(declarator, source)[0]
+				if name is not None: declared.setdefault(name, []).append((start, declared_type(declaration, declarator, source)))
+				else:
+					for name in declarator_names(declarator, source): declared.setdefault(name, []).append((start, None))
+		def add_unknown(child):
+			for identifier in find_all_in_children(child, "identifier"):
+				declared.setdefault(source[identifier.start_byte:identifier.end_byte], []).append((child.start_byte, None))
+
+		if node.type in FUNCTION_TYPES:
+			declarator = function_declarator(node)
+			parameters = declarator.child_by_field_name("parameters") if declarator is not None else None
+			for parameter in parameters.named_children if parameters is not None else []:
+				if "parameter_declaration" in parameter.type: add(parameter, 0)
+			captures = node.child_by_field_name("captures")
+			for capture in captures.named_children if captures is not None else []:
+				if capture.type == "assignment_expression": add_unknown(capture.child_by_field_name("left")) # [name = value]
+		elif node.type == "for_range_loop":
+			body = node.child_by_field_name("body")
+			if body is not None: add(node, body.start_byte) # Only the body sees the loop's variable
+		else:
+			for child in node.children:
+				match child.type:
+					case "declaration": add(child, child.start_byte)
+					case "condition_clause" | "init_statement" | "parameter_list": # if/switch/while initializers and catch parameters
+						for inner in find_all_in_children(child, ["declaration", "parameter_declaration"], prune=["lambda_expression", "compound_statement"]): add(inner, child.start_byte)
+					case "using_declaration" | "alias_declaration" | "namespace_alias_definition": add_unknown(child)
+		self.scopes[node.id] = declared
+		return declared
+
+	# The (class name, number of pointers, whether the class is const) type of the variable the identifier refers to, None when it isn't certain
+	def variable_type(self, identifier) -> tuple[str, int, bool] | None:
+		name = self.source[identifier.start_byte:identifier.end_byte]
+		child, node = identifier, identifier.parent
+		copied = False # Whether a lambda captured the variable by copy on the way out
+		while node is not None:
+			match node.type:
+				case "argument_list": pass
+				case type if type.endswith("_expression") and type not in ["lambda_expression", "compound_expression"]: pass # Expressions never declare anything
+				case "translation_unit": return self.globals.get(name)
+				case "field_declaration_list": # Members are visible within the class's methods
+					members = self.members_of(node.parent)
+					if members is None: return None
+					if name in members.fields:
+						this = self.this_type(identifier) # The fields are const in const methods
+						return members.fields[name] if this is None or members.fields[name] is None else members.field_type(name, this[2], hidden=True)
+					if name in members.methods or not members.closed: return None
+				case _:
+					visible = [type for start, type in self.declarations(node).get(name, []) if start <= child.start_byte]
+					if len(visible) > 0:
+						type = visible[-1]
+						return (type[0], 0, True) if copied and type is not None and type[1] == 0 else type # The copy of a pointer still points to the same object
+					if node.type == "lambda_expression": copied = copied or self.captures_by_copy(node, name)
+					if node.type == "declaration_list": return None # Namespaces can be reopened (or come from headers) with more in them
+					if node.type in FUNCTION_TYPES and node.type != "lambda_expression" and node.parent.type != "field_declaration_list":
+						declarator = function_declarator(node)
+						declarator = declarator.child_by_field_name("declarator") if declarator is not None else None
+						if declarator is None or declarator.type != "identifier": return None # The members of methods defined outside of their class are in scope too
+			child, node = node, node.parent
+		return None
+
+	# Whether the lambda captures the variable by copy, which makes it const within the lambda (unless the lambda is mutable)
+	def captures_by_copy(self, lambda_, name: str) -> bool:
+		captures = lambda_.child_by_field_name("captures")
+		declarator = lambda_.child_by_field_name("declarator")
+		if captures is None or (declarator is not None and any(child.type == "type_qualifier" and self.source[child.start_byte:child.end_byte].strip() == "mutable" for child in declarator.children)): return False
+		copy = False
+		for capture in captures.named_children:
+			text = self.source[capture.start_byte:capture.end_byte].strip()
+			if capture.type == "lambda_default_capture": copy = text == "="
+			elif text == name: return True
+			elif text.lstrip("&").strip() == name: return False # [&name]
+		return copy
+
+	# The type of the given expression (see variable_type), None when it isn't certain
+	def expression_type(self, node) -> tuple[str, int, bool] | None:
+		match node.type:
+			case "identifier": return self.variable_type(node)
+			case "this": return self.this_type(node)
+			case "parenthesized_expression":
+				return self.expression_type(node.named_children[0]) if node.named_child_count == 1 else None
+			case "pointer_expression":
+				argument = node.child_by_field_name("argument")
+				type = self.expression_type(argument) if node.children[0].type == "*" and argument is not None else None
+				return (type[0], type[1] - 1, type[2]) if type is not None and type[1] > 0 else None
+			case "field_expression":
+				argument, field = node.child_by_field_name("argument"), node.child_by_field_name("field")
+				type = self.expression_type(argument) if argument is not None and field is not None and field.type == "field_identifier" else None
+				if type is None or type[1] != (1 if node.children[1].type == "->" else 0): return None
+				members = self.classes.get(type[0])
+				name = self.source[field.start_byte:field.end_byte]
+				return members.field_type(name, type[2]) if members is not None and name not in self.functions else None # See resolve_ufcs
+		return None
+
+	# The type of this in the method the node is in (a const method's this points to a const object)
+	def this_type(self, node) -> tuple[str, int, bool] | None:
+		method = None
+		while node is not None and node.type != "field_declaration_list":
+			if node.type in FUNCTION_TYPES and node.type != "lambda_expression": method = node
+			node = node.parent
+		members = self.members_of(node.parent) if node is not None else None
+		if members is None or method is None: return None
+		signature = ClassMembers.signature(method.child_by_field_name("declarator"), self.source)
+		return (class_name(members.node, self.source), 1, signature[1]) if signature is not None else None
+
+	# How a UFCS call (or property, when there is no argument list) resolves: "member" (argument.function), "method" (a property which calls argument.function()),
+	# "free" (function(argument))... or None when only the C++ compiler can tell (and the CPPE_UFCS macros have to be used)
+	def resolve_ufcs(self, argument, function, onPointer: bool, arguments = None) -> str | None:
+		if function.type == "qualified_name": return "free" if not onPointer and not self.forwarding else None # The macros never consider members for these
+		name = function.child_by_field_name("name") if function.type == "template_method" else function
+		if name is None or name.type != "field_identifier": return None
+		name = self.source[name.start_byte:name.end_byte]
+		if name not in self.names: return None # Nothing to resolve to... no need to find out what the argument is
+		count = 0
+		for child in arguments.named_children if arguments is not None else []:
+			if child.type == "parameter_pack_expansion": return None # No telling how many arguments there are
+			if child.type != "comment": count += 1
+		type = self.expression_type(argument)
+		if type is None or type[1] != (1 if onPointer else 0) or (members := self.classes.get(type[0])) is None: return None
+
+		# NOTE: The macros only use the member when obj.function(arguments...) compiles, so it has to be public (and take exactly these arguments)...
+		# and with a free function of the same name around the macros could just as well pick that
+		if name in members.fields or name in members.methods:
+			if name in self.functions or function.type == "template_method": return None
+			if name in members.fields: return "member" if arguments is None and name not in members.hidden else None
+			if members.calls_method(name, count, type[2]): return "member" if arguments is not None else "method"
+			return None
+		# NOTE: Without the member the macros fall back to the free function, unless it can't be called with these arguments... and then CPPE_operator_forward is tried
+		if members.closed and not onPointer and not self.forwarding and name in self.functions: return "free"
+		return None
 
 class NodeState:
+	# NOTE: A state is created for nearly every node, so they are kept as small (and as quick to copy) as possible
+	__slots__ = ["labeled_depth", "current_function", "unit", "node", "array_type"]
+
 	def __init__(self):
 		self.labeled_depth : int = 0
 		# self.function_return = "void" # TODO: Probably want to save the full signature
 		self.current_function = None
+		self.unit : TranslationUnit = None # NOTE: Shared (not copied) between every state of the same file
 		self.node = None	
+		self.array_type : str | None = None # Element type of the innermost array type processed (see process_array_type)
 
 	def clone(self):
-		return copy.copy(self)
+		return self.clone_with_node(self.node)
 
 	def __pos__(self): # Unary +
 		return self.clone()
@@ -61,7 +565,13 @@ class NodeState:
 		return self
 
 	def clone_with_node(self, node):
-		return self.clone().with_node(node)
+		out = NodeState.__new__(NodeState) # Skips __init__ since every field is about to be overwritten
+		out.labeled_depth = self.labeled_depth
+		out.current_function = self.current_function
+		out.unit = self.unit
+		out.node = node
+		out.array_type = self.array_type
+		return out
 
 	def __add__(self, node): # Binary +
 		return self.clone_with_node(node)
@@ -70,32 +580,20 @@ class NodeState:
 		self.current_function = function
 		return self
 
+	def with_unit(self, unit: TranslationUnit):
+		self.unit = unit
+		return self
+
 	# Checks if the given expression node is within an expression
 	def in_expression(self, node = None) -> bool:
-		if node is None: node = self.node
-		parent = skip_labeled_parents(node)
-		if "init_declarator" in parent.type: return True
-		if "expression" not in parent.type: return False
-		if parent.type == "expression_statement": return False #TODO: Are there any cases where this causes issues?
-		if "compound" in parent.type:
-			ret = parent.child_by_field_name("return")
-			return ret == node\
-				or (ret is not None and ret.type in ["labeled_expression", "possibly_labeled_control_flow_expression"]) #TODO: make sure this works
-		return True
-
-	# Replace all of the text for the given child with the given replacement
-	def replace_child_in_output(self, node_out, child, replacement: str | None = None, from_back: bool = True):
-		out = node_out
-		if not isinstance(node_out, str):
-			out = process_default_node(self + node_out)
+		return in_expression(node if node is not None else self.node)
 
+	# Process the given node with all of the text for the given child replaced with the given replacement (along with any other provided replacements)
+	def replace_child_in_output(self, node, child, replacement: str | None = None, replacements: list | None = None):
+		replacements = list(replacements or [])
 		if isinstance(replacement, str) and len(replacement) > 0:
-			defaultChild = child
-			if not isinstance(child, str):
-				defaultChild = process(self + child)
-			if from_back: out = rreplace(out, defaultChild, replacement)
-			else: out = out.replace(defaultChild, replacement, 1)
-		return out
+			replacements.append((child, replacement))
+		return (yield from process_default_node(self + node, replacements))
 
 
 class QualifiedIdentifier:
@@ -137,10 +635,10 @@ class Function(QualifiedIdentifier):
 		@classmethod
 		def parse(cls, state: NodeState):
 			out = cls()
-			out.type = process(state + state.node.children[0])
-			out.name = process(state + state.node.children[1])
+			out.type = yield state + state.node.children[0]
+			out.name = yield state + state.node.children[1]
 			if len(state.node.children) > 2:
-				out.default = process(state + state.node.children[2])
+				out.default = yield state + state.node.children[2]
 			return out
 
 		def __str__(self):
@@ -148,6 +646,7 @@ class Function(QualifiedIdentifier):
 
 	def __init__(self):
 		self.parent = None
+		self.node = None
 		self.toPrint = ""
 		self.toPrintParameters = ""
 		self.name = QualifiedIdentifier()
@@ -155,6 +654,11 @@ class Function(QualifiedIdentifier):
 		self.trailing_return = False
 		self.parameters = []
 		self.originalParameters = None
+		# The header is printed by splicing these (node, replacement) edits into the function's node
+		self.state = None
+		self.edits = []
+		self.return_node = None
+		self.parameters_node = None
 
 	@classmethod
 	def parse(cls, state: NodeState):
@@ -162,23 +666,31 @@ class Function(QualifiedIdentifier):
 		body = node.child_by_field_name("body")
 		
 		out = cls()
+		out.node = node
 		out.parent = state.current_function
 
-		out.return_type = process(state + node.children[-3])
+		out.return_node = node.children[-3]
+		out.return_type = yield state + out.return_node
 		declarator = node.children[-2]
-		out.name = QualifiedIdentifier.parse(process(state + declarator.children[0]))
-		parameters = declarator.children[1]
-		out.toPrintParameters = process(state + parameters)
-		out.parameters = [Function.Parameter.parse(state + child) for child in parameters.children[1:-1]]
-
-		trailingReturn = find_in_children(declarator, "trailing_return_type")
+		out.name = QualifiedIdentifier.parse((yield state + declarator.children[0]))
+		parameters = out.parameters_node = declarator.children[1]
+		out.toPrintParameters = yield state + parameters
+		out.parameters = []
+		for child in parameters.children[1:-1]:
+			out.parameters.append((yield from Function.Parameter.parse(state + child)))
+
+		trailingReturn = find_in_children(declarator, "trailing_return_type", prune=["parameter_list", "compound_statement"])
 		if trailingReturn is not None:
 			if out.return_type not in ["auto", "fn"]:
 				raise RuntimeError("Trailing return type must follow auto or fn")
-			out.return_type = process(state + trailingReturn.children[-1])
+			out.return_node = trailingReturn.children[-1]
+			out.return_type = yield state + out.return_node
+			out.trailing_return = True
 
-		body = process((state + body).with_function(out))
-		out.toPrint = process_default_node(state.with_function(out)).replace(body, "")
+		out.state = state.with_function(out)
+		out.edits = [(body, "")]
+		body = yield (state + body).with_function(out)
+		out.toPrint = yield from process_default_node(out.state, out.edits)
 
 		return out, body
 
@@ -188,23 +700,30 @@ class Function(QualifiedIdentifier):
 		body = node.child_by_field_name("body")
 		
 		out = cls()
+		out.node = node
 		out.parent = state.current_function
 		out.return_type = "auto"
 		out.name = QualifiedIdentifier()
 
 		declarator = node.children[-2]
-		parameters = declarator.children[1]
-		out.toPrintParameters = process(state + parameters)
-		out.parameters = [Function.Parameter.parse(state + child) for child in parameters.children[1:-1]]
+		parameters = out.parameters_node = declarator.children[1]
+		out.toPrintParameters = yield state + parameters
+		out.parameters = []
+		for child in parameters.children[1:-1]:
+			out.parameters.append((yield from Function.Parameter.parse(state + child)))
 
-		trailingReturn = find_in_children(declarator, "trailing_return_type")
+		trailingReturn = find_in_children(declarator, "trailing_return_type", prune=["parameter_list", "compound_statement"])
 		if trailingReturn is not None:
 			if out.return_type not in ["auto", "fn"]:
 				raise RuntimeError("Trailing return type must follow auto or fn")
-			out.return_type = process(state + trailingReturn.children[-1])
+			out.return_node = trailingReturn.children[-1]
+			out.return_type = yield state + out.return_node
+			out.trailing_return = True
 
-		body = process((state + body).with_function(out))
-		out.toPrint = process_default_node(state.with_function(out)).replace(body, "")
+		out.state = state.with_function(out)
+		out.edits = [(body, "")]
+		body = yield (state + body).with_function(out)
+		out.toPrint = yield from process_default_node(out.state, out.edits)
 
 		return out, body
 
@@ -212,13 +731,13 @@ class Function(QualifiedIdentifier):
 		self.originalParameters = self.parameters
 		self.parameters = newParams
 		newParamsStr = f"({', '.join([str(param) for param in newParams])})"
-		self.toPrint = self.toPrint.replace(self.toPrintParameters, newParamsStr)
+		self.edits.append((self.parameters_node, newParamsStr))
+		self.toPrint = yield from process_default_node(self.state, self.edits)
 		self.toPrintParameters = newParamsStr
 
 	def replace_return_type(self, newReturn: str):
-		if self.trailing_return:
-			self.toPrint = rreplace(self.toPrint, self.return_type, newReturn, 1)
-		else: self.toPrint = self.toPrint.replace(self.return_type, newReturn, 1)
+		self.edits.append((self.return_node, newReturn))
+		self.toPrint = yield from process_default_node(self.state, self.edits)
 		self.return_type = newReturn
 
 	def __str__(self):
@@ -226,172 +745,161 @@ class Function(QualifiedIdentifier):
 
 
 
-def process(state: NodeState, Type: str | None = None):
-	if Type is None: Type = state.node.type
-
-	out = ""
-	match Type:
-		case "product_type":
-			out += process_product_type(state)
-
-		case "sum_type":
-			out += process_sum_type(state)
-
-		case "array_type":
-			out += process_array_type(state)
-
-		case "function_definition" | "inline_method_definition" | "operator_cast_definition": #TODO: Does operator_cast work properly?
-			out += process_function(state)
-
-		case "lambda_expression":
-			out += process_lambda(state)
-
-		case "expression_body":
-			out += process_expression_body(state)
-
-		case "switch_statement" | "try_statement":
-			out += process_switch_try(state)
-
-		case "case_statement":
-			out += process_switch_case(state)
-
-		case "catch_clause":
-			out += process_catch_clause(state)
-
-		case "compound_expression":
-			out += process_compound_expression(state)
-
-		case "if_statement":
-			out += process_if(state)
-
-		case "for_statement" | "while_statement" | "do_statement":
-			out += process_standard_loop(state)
-
-		case "for_range_loop":
-			out += process_range_for(state)
-
-		case "labeled_expression" | "possibly_labeled_control_flow_expression":
-			out += process_labeled_expression(state)
-
-		case "labeled_statement":
-			out += process_labeled_statement(state)
-
-		case "return_statement":
-			out += process_return_statement(state)
-
-		case "yield_statement":
-			out += process_yield_statement(state)
-
-		case "defer_statement":
-			out += process_defer_statement(state)
-
-		case "break_statement":
-			out += process_break_statement(state)
-
-		case "continue_statement":
-			out += process_continue_statement(state)
-
-		case "call_expression":
-			out += process_call_expression(state)
-
-		case "field_expression":
-			out += process_field_expression(state)
-
-		# By default just print whatever parts of this node are unique and recursively process the children
-		case other:
-			out += process_default_node(state)
-
-	return out
-
-def process_default_node(state: NodeState):
+# Node types whose processing has side effects on the state passed to them (and thus can't be memoized)
+UNMEMOIZED_TYPES = ["array_type"]
+
+# Set (by main) to record how long each node takes to translate
+profiler: Profiler | None = None
+
+# Translates the given node... handlers are generators which yield the state of every node they need translated and are sent back its translation,
+# this loop keeps the handlers of every node currently being translated on an explicit stack so arbitrarily deep trees never recurse
+def process(state: NodeState, Type: str | None = None) -> str:
+	unit = state.unit
+	stack = [] # (handler, memo key, type) of every node currently being translated
+	request, value = state, None
+	try:
+		while True:
+			if request is not None:
+				node = request.node
+				type = Type or node.type
+				Type = None # Only applies to the node we were asked to translate
+				if profiler is not None: profiler.enter()
+
+				if (node.child_count == 0 and type not in HANDLERS) or (type == node.type and unit.index.is_verbatim(node)): # Leaves (and plain C++) are just their text
+					value = unit.source[node.start_byte:node.end_byte]
+					if profiler is not None: profiler.exit(type, value)
+				else:
+					# Many handlers process the same subtree more than once... so remember what each node (in each context) translated to
+					key = None
+					if type not in UNMEMOIZED_TYPES:
+						key = (node.start_byte, node.end_byte, type, request.labeled_depth, request.current_function, request.array_type)
+					if key is not None and key in unit.memo:
+						unit.statistics["memo hits"] += 1
+						value = unit.memo[key]
+						if profiler is not None: profiler.exit(type, value)
+					else:
+						if key is not None: unit.statistics["memo misses"] += 1
+						stack.append((HANDLERS.get(type, process_default_node)(request), key, type))
+						value = None
+				request = None
+				if len(stack) == 0: return value
+
+			# Resume the innermost handler with the translation it asked for
+			try: request = stack[-1][0].send(value)
+			except StopIteration as done:
+				_, key, type = stack.pop()
+				value = done.value
+				if key is not None: unit.memo[key] = value
+				if profiler is not None: profiler.exit(type, value)
+				if len(stack) == 0: return value
+	except BaseException:
+		if profiler is not None: profiler.abandon(len(stack))
+		raise
+
+# Prints the node with each of its children processed... any (node, text) replacements are spliced in place of the nodes they name
+# NOTE: Replacements may target any descendant, the nodes between this one and the replaced node are printed as default nodes
+def process_default_node(state: NodeState, replacements: list | None = None):
 	node = state.node
-	out = ""
+	source = state.unit.source
+	out = []
 	start = node.start_byte
 	for child in node.children:
-		out += raw[start:child.start_byte].decode("utf8")
-		out += process(state + child)
+		if not replacements and child.child_count == 0 and child.type not in HANDLERS:
+			continue # Leaves are printed verbatim along with the text surrounding them
+		out.append(source[start:child.start_byte])
+		out.append((yield state + child) if not replacements else (yield from splice_child(state, child, replacements)))
 		start = child.end_byte
-	out += raw[start:node.end_byte].decode("utf8")
-	return out
+	out.append(source[start:node.end_byte])
+	return "".join(out)
+
+def splice_child(state: NodeState, child, replacements: list):
+	for target, replacement in replacements:
+		if target.id == child.id: return replacement
+	for target, _ in replacements:
+		if child.start_byte <= target.start_byte and target.end_byte <= child.end_byte and child.child_count > 0:
+			return (yield from process_default_node(state + child, replacements))
+	return (yield state + child)
 
 
 
 
 def process_product_type(state: NodeState):
-	return "::CPPE::product_t" + process_default_node(state)
+	state.unit.use("product_sum.hpp")
+	return "::CPPE::product_t" + (yield from process_default_node(state))
 
 def process_sum_type(state: NodeState):
-	return "::CPPE::sum_t<" + process_default_node(state).replace("|", ",") + ">" # TODO: Are there any other cases where there would be a | in a type?
+	state.unit.use("product_sum.hpp")
+	return "::CPPE::sum_t<" + (yield from process_default_node(state, [(child, ",") for child in state.node.children if child.type == "|"])) + ">"
 
 def process_array_type(state: NodeState):
-	state.array_type = getattr(state, "array_type", None)
 	node = state.node
-	size = process(state + state.node.children[2])
+	size = yield state + state.node.children[2]
 
 	underlyingType = "std::span" if size.strip() == ']' else ("std::vector" if size.strip() == '...' else "std::array")
+	state.unit.use("<" + underlyingType.removeprefix("std::") + ">")
 	wrapperType = None
 
-	out = ""
+	out = []
 	start = node.start_byte
 	for i, child in enumerate(node.children):
-		out += raw[start:child.start_byte].decode("utf8")
+		out.append(state.unit.source[start:child.start_byte])
 		match i:
 			case 0:
-				type = process(state.with_node(child)) # NOTE: that we are passing the state by reference here since we need data to propigate back up!
-				out += underlyingType + "<" + (state.array_type if state.array_type else type)
+				type = yield state.with_node(child) # NOTE: that we are passing the state by reference here since we need data to propigate back up!
+				out.append(underlyingType + "<" + (state.array_type if state.array_type else type))
 				wrapperType = type if state.array_type else None
-			case 1: out += process(state + child).replace("[", ", " if underlyingType == "std::array" else "")
-			case 2: out += size.replace(']', '>').replace("...", "")
-			case _: out += process(state + child).replace("]", ">")
+			case 1: out.append((yield state + child).replace("[", ", " if underlyingType == "std::array" else ""))
+			case 2: out.append({"]": ">", "...": ""}.get(size.strip(), size))
+			case _: out.append((yield state + child).replace("]", ">"))
 		start = child.end_byte
-	out += raw[start:node.end_byte].decode("utf8")
+	out.append(state.unit.source[start:node.end_byte])
+	out = "".join(out)
 
 	if wrapperType is not None:
 		out = wrapperType.replace(state.array_type, out)
 
 	if node.children[0].type != "array_type":
-		state.array_type = process(state + node.children[0])
+		state.array_type = yield state + node.children[0]
 	return out
 
 
 
 
 def process_function(state: NodeState):
-	f, body = Function.parse(state)
+	f, body = yield from Function.parse(state)
 
 	if f.name.name == "main"\
 	  and len(f.name.namespace) == 0\
 	  and len(f.parameters) <= 2\
 	  and f.return_type in ["void", "fn", "auto", "int"]:
-		f.replace_return_type("int")
+		yield from f.replace_return_type("int")
 		if len(f.parameters) == 1 and ("string" in f.parameters[0].type or f.parameters[0].type == "auto"):
-			f.replace_parameters([Function.Parameter("int", "CPPE_argc"), Function.Parameter("const char**", "CPPE_argv")])
+			yield from f.replace_parameters([Function.Parameter("int", "CPPE_argc"), Function.Parameter("const char**", "CPPE_argv")])
 			if f.originalParameters[0].type == "auto": f.originalParameters[0].type = "std::vector<std::string_view>"
-			body = body.replace("{", f"{{ CPPE_CONVERT_ARGC_ARGV_TO(CPPE_argc, CPPE_argv, {f.originalParameters[0].type}, {f.originalParameters[0].name})", 1)	
+			state.unit.use("control_flow.hpp", "<vector>", "<string_view>")
+			body = replace_braces(body, f"{{ CPPE_CONVERT_ARGC_ARGV_TO(CPPE_argc, CPPE_argv, {f.originalParameters[0].type}, {f.originalParameters[0].name})")
 
-	if "CPPE_RETURN" in body:
-		body = body.replace("{", f"{{ CPPE_DEFINE_PROPIGATOR_START(<{f.name}>, {f.return_type}, nullptr, 0)", 1)
-		body = rreplace(body, "}", f"CPPE_DEFINE_PROPIGATOR_END(<{f.name}>, {f.return_type}) }}")
-	else: body = body.replace("&CPPE_propigate_0", "nullptr")
+	if state.unit.index.has_expression_returns(f.node):
+		state.unit.use("control_flow.hpp")
+		body = replace_braces(body, f"{{ CPPE_DEFINE_PROPIGATOR_START(<{f.name}>, {f.return_type}, nullptr, 0)", f"CPPE_DEFINE_PROPIGATOR_END(<{f.name}>, {f.return_type}) }}")
 
 	#TODO: Do we want to do anything with turning nested functions into lambdas?
 
-	prototypes.append(f.toPrint + ";")
+	state.unit.prototypes.add(f.toPrint + ";")
 	return f.toPrint + body
 
 def process_lambda(state: NodeState):
-	f, body = Function.parse_lambda(state)
+	f, body = yield from Function.parse_lambda(state)
 	# print(f.name)
 
-	if "CPPE_RETURN" in body:
-		body = body.replace("{", f"{{ CPPE_DEFINE_PROPIGATOR_START(<{f.name}>, {f.return_type}, nullptr, 0)", 1)
-		body = rreplace(body, "}", f"CPPE_DEFINE_PROPIGATOR_END(<{f.name}>, {f.return_type}) }}")
-	else: body = body.replace("&CPPE_propigate_0", "nullptr")
+	if state.unit.index.has_expression_returns(f.node):
+		state.unit.use("control_flow.hpp")
+		body = replace_braces(body, f"{{ CPPE_DEFINE_PROPIGATOR_START(<{f.name}>, {f.return_type}, nullptr, 0)", f"CPPE_DEFINE_PROPIGATOR_END(<{f.name}>, {f.return_type}) }}")
 
 	return f.toPrint + body
 
 def process_expression_body(state: NodeState):
-	return f"{{ return {process(state + state.node.children[1])}; }}" # We know the expression is always the second child!
+	return f"{{ return {(yield state + state.node.children[1])}; }}" # We know the expression is always the second child!
 
 
 
@@ -400,34 +908,39 @@ def process_return_statement(state: NodeState):
 	node = state.node
 	usefulParent = node.parent.parent # .parent is usually a compound expression, .parent.parent is wrapping control flow #TODO: How many bugs does this assumption produce?
 	expression = state.in_expression(node.parent.parent)
-	if not expression: return process_default_node(state + node)
-	return f"CPPE_RETURN({process(state + node.children[1])}, 0);".replace("(;, 0)", "({}, 0)")
+	if not expression: return (yield from process_default_node(state + node))
+	state.unit.use("control_flow.hpp")
+	return f"CPPE_RETURN({(yield state + node.children[1])}, 0);".replace("(;, 0)", "({}, 0)")
 
 def process_yield_statement(state: NodeState):
 	# return process_default_node(state).replace("yield", "return")
-	return f"CPPE_YIELD({process(state + state.node.children[1])}, 0);".replace("(;, 0)", "({}, 0)")
+	state.unit.use("control_flow.hpp")
+	return f"CPPE_YIELD({(yield state + state.node.children[1])}, 0);".replace("(;, 0)", "({}, 0)")
 
 def process_break_statement(state: NodeState):
 	label = state.node.child_by_field_name("label")
-	if label is None: return process_default_node(state)
-	return f"CPPE_BREAK({process(state + label)}, {state.labeled_depth});"
+	if label is None: return (yield from process_default_node(state))
+	if state.unit.index.is_goto(state.node): return f"goto CPPE_break_{(yield state + label).strip()};"
+	state.unit.use("control_flow.hpp")
+	return f"CPPE_BREAK({(yield state + label)}, {state.labeled_depth});"
 
 def process_continue_statement(state: NodeState):
 	label = state.node.child_by_field_name("label")
-	if label is None: return process_default_node(state)
-	return f"CPPE_CONTINUE({process(state + label)}, {state.labeled_depth});"
+	if label is None: return (yield from process_default_node(state))
+	if state.unit.index.is_goto(state.node): return f"goto CPPE_continue_{(yield state + label).strip()};"
+	state.unit.use("control_flow.hpp")
+	return f"CPPE_CONTINUE({(yield state + label)}, {state.labeled_depth});"
 
 def process_defer_statement(state: NodeState):
-	return f"defer {{ {process(state + state.node.child_by_field_name('body'))} }};"
+	state.unit.use("defer.hpp", "ufcs.hpp") # NOTE: defer's lambda is ALWAYS_INLINE_LAMBDA
+	return f"defer {{ {(yield state + state.node.child_by_field_name('body'))} }};"
 
 def process_compound_expression(state: NodeState, parent_valid : bool | None = None, label : str | None = None):
 	node = state.node
 	implicitReturn = node.child_by_field_name('return')
-	out = process_default_node(state + node)
-
 	if implicitReturn is not None:
-		wrong = process(state + implicitReturn)
-		out = rreplace(out, wrong, f"return {wrong};")
+		out = yield from process_default_node(state + node, [(implicitReturn, f"return {(yield state + implicitReturn)};")])
+	else: out = yield from process_default_node(state + node)
 	# elif not "return" in out and state.in_expression(): # TODO: Not working!
 	# 	raise RuntimeError("Compound expressions must (implicitly) return a value!")
 
@@ -439,43 +952,44 @@ def process_compound_expression(state: NodeState, parent_valid : bool | None = N
 	if parent_valid is None: parent_valid = node.parent.type in valid_parents
 	if parent_valid:
 		return out
+	state.unit.use("ufcs.hpp")
 	return "[&] ALWAYS_INLINE_LAMBDA " + out + "()"
 
 def process_labeled_statement(state: NodeState):
 	node = state.node
-	label = process_default_node(state + node.child_by_field_name("label"))
+	label = yield from process_default_node(state + node.child_by_field_name("label"))
 	child = node.children[2] # We know the nested expression is always the third child
 
 	match child.type:
 		case "compound_expression":
-			return process_compound_expression(state + child, None, label)
+			return (yield from process_compound_expression(state + child, None, label))
 
 		case "for_statement" | "while_statement" | "do_statement":
-			return label + ": " + process_standard_loop(state + child, label)
+			return (yield from process_standard_loop(state + child, label, prefix=label + ": "))
 
 		case "for_range_loop":
-			return label + ": " + process_range_for(state + child, label)
+			return (yield from process_range_for(state + child, label, prefix=label + ": "))
 
 		case other:
-			return process_default_node(state + node) # If it isn't a loop there is no need to specially process loop labeling
+			return (yield from process_default_node(state + node)) # If it isn't a loop there is no need to specially process loop labeling
 
 def process_labeled_expression(state: NodeState):
 	node = state.node
 	label = node.child_by_field_name("label")
 	if label is None:
-		return process(state + node.children[0]) # This is a possibly labeled_control_flow, so the only child should get passed through
-	label = process_default_node(state + label)
+		return (yield state + node.children[0]) # This is a possibly labeled_control_flow, so the only child should get passed through
+	label = yield from process_default_node(state + label)
 	child = node.children[2] # We know the nested expression is always the third child
 
 	match child.type:
 		case "compound_expression":
-			return process_compound_expression(state + child, None, label)
+			return (yield from process_compound_expression(state + child, None, label))
 
 		case "for_statement" | "while_statement" | "do_statement":
-			return process_standard_loop(state + child, label)
+			return (yield from process_standard_loop(state + child, label))
 
 		case "for_range_loop":
-			return process_range_for(state + child, label)
+			return (yield from process_range_for(state + child, label))
 
 		case other: raise RuntimeError("Invalid type of labeled expression: " + child.type)
 
@@ -484,8 +998,10 @@ def process_switch_try(state: NodeState, label: str | None = None):
 	expression = state.in_expression()
 
 	body = node.child_by_field_name("body")
-	out = process_default_node(state + node) if node.type == "switch_expression" else state.replace_child_in_output(node, body, process_compound_expression(state + body, True, label), False)
+	if node.type == "switch_expression": out = yield from process_default_node(state + node)
+	else: out = yield from state.replace_child_in_output(node, body, (yield from process_compound_expression(state + body, True, label)))
 	if expression:
+		state.unit.use("ufcs.hpp")
 		out = wrap_if_not_compound(out, node.type)
 	return out
 
@@ -494,13 +1010,13 @@ def process_switch_case(state: NodeState, label: str | None = None):
 	isExpression = state.in_expression()
 	expression = node.child_by_field_name("expression")
 	if expression is None:
-		return process_default_node(state + node)
+		return (yield from process_default_node(state + node))
 
-	return state.replace_child_in_output(node, expression, f": {process(state + expression)} break;")
+	return (yield from state.replace_child_in_output(node, expression, f": {(yield state + expression)} break;"))
 
 def process_catch_clause(state: NodeState, label: str | None = None):
 	body = state.node.child_by_field_name("body")
-	return state.replace_child_in_output(state.node, body, process_compound_expression(state + body, True, label))
+	return (yield from state.replace_child_in_output(state.node, body, (yield from process_compound_expression(state + body, True, label))))
 
 def process_if(state: NodeState, label: str | None = None):
 	node = state.node
@@ -511,97 +1027,124 @@ def process_if(state: NodeState, label: str | None = None):
 
 	if alternative is None:
 		if expression:
-			consequenceTxt = process(state + consequence)
+			state.unit.use("ufcs.hpp", "<optional>")
+			consequenceTxt = yield state + consequence
 			consequenceBody = f"auto consequence = {wrap_if_not_compound(consequenceTxt, consequence.type)[:-2]};" #TODO: Get line
 
 			out = f"[&] ALWAYS_INLINE_LAMBDA {{ {consequenceBody}\nusing sum_t = std::optional<decltype(consequence())>;\n"
-			out += process_default_node(state)\
-				.replace(consequenceTxt, "return sum_t(consequence());", 1)
+			out += yield from process_default_node(state, [(consequence, "return sum_t(consequence());")])
 			out += " return sum_t{}; }()"
-		else: out = state.replace_child_in_output(node, consequence, process_compound_expression(state + consequence, True, label), False)
+		else: out = yield from state.replace_child_in_output(node, consequence, (yield from process_compound_expression(state + consequence, True, label)))
 	elif not expression:
-		out = state.replace_child_in_output(node, consequence, process_compound_expression(state + consequence, True, label), False)
+		out = yield from state.replace_child_in_output(node, consequence, (yield from process_compound_expression(state + consequence, True, label)))
 
 	# If we have an alternative and are in an expression... we need to calculate sum types!
 	elif expression:
-		consequenceTxt = process(state + consequence)
-		alternativeTxt = process(state + alternative)
+		state.unit.use("ufcs.hpp", "product_sum.hpp")
+		consequenceTxt = yield state + consequence
+		alternativeTxt = yield state + alternative
 		consequenceBody = f"auto consequence = {wrap_if_not_compound(consequenceTxt, consequence.type)[:-2]};" #TODO: Get line
 		alternativeBody = f"auto alternative = {wrap_if_not_compound(alternativeTxt, alternative.type)[:-2]};" #TODO: Get line
 
 		# TODO: How will we extract indentation for this?
 		out = f"[&] ALWAYS_INLINE_LAMBDA {{ {consequenceBody}\n{alternativeBody}\nusing sum_t = ::CPPE::sum_t<decltype(consequence()), decltype(alternative())>;\n"
-		out += process_default_node(state)\
-			.replace(consequenceTxt, "return CPPE_PROMOTE(sum_t, consequence());", 1)
-		out = rreplace(out, alternativeTxt, "return CPPE_PROMOTE(sum_t, alternative());", 1)
+		out += yield from process_default_node(state, [(consequence, "return CPPE_PROMOTE(sum_t, consequence());"), (alternative, "return CPPE_PROMOTE(sum_t, alternative());")])
 		out += " }()"
 
 	return out
 
-def process_range_for(state: NodeState, label: str | None = None):
+def process_range_for(state: NodeState, label: str | None = None, result: str = "vector", prefix: str = ""):
 	node = state.node
-	numChildren = len(node.children)
-	out = ""
-	start = node.start_byte
-	for i, child in enumerate(node.children):
-		out += raw[start:child.start_byte].decode("utf8")
-		match i:
-			# We split out the nodes like this so we can surgically replace in with : and foreach with for
-			case 0: out += process(state + child).replace("foreach", "for")
-			case 4: out += process(state + child).replace("in", ":") if numChildren <= 8 else process(state + child) # in could be in either one of these depending on if there is an initializer or not!
-			case 5: out += process(state + child) if numChildren <= 8 else process(state + child).replace("in", ":") # in could be in either one of these depending on if there is an initializer or not!
-			case other: out += process(state + child)
-		start = child.end_byte
-	out += raw[start:node.end_byte].decode("utf8")
+	# We surgically replace foreach with for and in with :
+	replacements = []
+	if (yield state + node.children[0]) == "foreach": replacements.append((node.children[0], "for"))
+	inNode = node.children[4 if len(node.children) <= 8 else 5] # in could be in either one of these depending on if there is an initializer or not!
+	if (yield state + inNode) == "in": replacements.append((inNode, ":"))
+
+	# When the loop is an expression over a variable (not a call which shouldn't run twice) its trip count can be known up front
+	sized = None
+	range = inNode.next_named_sibling
+	if len(node.children) <= 8 and range is not None and range.type in ["identifier", "qualified_identifier"]:
+		sized = yield state + range
 
 	# Apply all of the replacements we would apply to other types of loops!
-	return process_standard_loop(state + node, label, out)
+	return (yield from process_standard_loop(state + node, label, replacements, result, sized, prefix))
 
-def process_standard_loop(state: NodeState, label: str | None = None, out: str | None = None):
+# NOTE: Expression loops collect the result of every iteration into a vector... unless the result is only counted (result="count"),
+# sized is the range a range-for iterates (when it is known to be safe to evaluate twice) so room can be reserved for every iteration up front,
+# and prefix is placed before the loop (its C++ label)
+def process_standard_loop(state: NodeState, label: str | None = None, replacements: list | None = None, result: str = "vector", sized: str | None = None, prefix: str = ""):
 	node = state.node
 	expression = state.in_expression()
+	if expression and is_discarded(node, state.unit.source): result = "count" # Counting is the cheapest way to run the loop without collecting anything
 
-	# TODO: Uncomment this optimization when we no longer need to test code around it!
-	# # Make sure we only pay for labeled continue/breaks if we use them!
-	# cbs = find_all_in_children(node, ["continue_statement", "break_statement"])
-	# cbs = [e for e in cbs if e.child_by_field_name("label") is not None]
-	# if len(cbs) == 0:
-	# 	label = None
+	# Make sure we only pay for labeled continue/breaks if we use them!
+	if label is not None and not state.unit.index.is_label_targeted(node, label):
+		label = None
+	# ...and that they only have to propigate when they jump out of lambdas (otherwise they are plain gotos)
+	gotoLabel = None
+	if label is not None and state.unit.index.jumps_with_goto(node):
+		gotoLabel, label = label.strip(), None
 
 	state.labeled_depth += 1 if label is not None else 0
+	# The outermost labeled loop propigates to its function... which only has a propigator if it returns from within an expression
+	parent = f"&CPPE_propigate_{state.labeled_depth - 1}"
+	if state.labeled_depth - 1 == 0 and state.current_function is not None and not state.unit.index.has_expression_returns(state.current_function.node):
+		parent = "nullptr"
 
 	body = node.child_by_field_name("body")
 	if not expression:
-		bodyText = process(state + body)
+		bodyText = yield state + body
 		replacement = bodyText
 		if label is not None:
+			state.unit.use("control_flow.hpp")
 			if not bodyText.strip().startswith("{"):
 				replacement = "{ " + replacement + " }"
-			replacement = replacement.replace("{", f"{{ CPPE_DEFINE_LOOP_PROPIGATOR_AND_HELPER_START({label}, {state.current_function.return_type}, &CPPE_propigate_{state.labeled_depth - 1}, {state.labeled_depth});", 1)
-			replacement = rreplace(replacement, "}", f"CPPE_DEFINE_LOOP_PROPIGATOR_END({label}, {state.current_function.return_type}); }}", 1)
-
-		out = state.replace_child_in_output(str_or(out, node), bodyText, replacement)
+			replacement = replace_braces(replacement,
+				f"{{ CPPE_DEFINE_LOOP_PROPIGATOR_AND_HELPER_START({label}, {state.current_function.return_type}, {parent}, {state.labeled_depth});",
+				f"CPPE_DEFINE_LOOP_PROPIGATOR_END({label}, {state.current_function.return_type}); }}")
+		elif gotoLabel is not None and "continue" in state.unit.index.kinds_of_jumps_to(node):
+			# NOTE: The body is nested in its own scope so continuing never jumps past any of its declarations
+			replacement = f"{{ {replacement} CPPE_continue_{gotoLabel}:; }}"
+
+		out = yield from state.replace_child_in_output(node, body, replacement, replacements)
+		if gotoLabel is not None and "break" in state.unit.index.kinds_of_jumps_to(node):
+			# NOTE: The loop and the target of its breaks have to stay one statement (the loop could be the body of an if or of another loop)
+			out = f"{{ {prefix}{out} CPPE_break_{gotoLabel}:; }}"
+			prefix = ""
 		# TODO: Why do inner labels disappear?
 
 
 	else:
+		state.unit.use("ufcs.hpp")
+		if label is not None: state.unit.use("control_flow.hpp")
 		if body.type == "compound_expression":
-			bodyText = process(state + body)
-		else: bodyText = wrap_if_not_compound(process(state + body), body.type, True)
-		loopBody = f"{{ CPPE_out.emplace_back(CPPE_loop_body()); }}"
+			bodyText = yield state + body
+		else: bodyText = wrap_if_not_compound((yield state + body), body.type, True)
+		if result == "count":
+			declaration = "std::size_t CPPE_out = 0;"
+			collect = "(void)CPPE_loop_body(); ++CPPE_out;"
+			state.unit.use("<cstddef>")
+		else:
+			declaration = "std::vector<decltype(CPPE_loop_body())> CPPE_out;"
+			if sized is not None:
+				declaration += f" ::CPPE::reserve_for(CPPE_out, {sized});"
+				state.unit.use("control_flow.hpp")
+			collect = "CPPE_out.emplace_back(CPPE_loop_body());"
+			state.unit.use("<vector>")
+		loopBody = f"{{ {collect} }}"
 		if label is not None:
-			loopBody = loopBody.replace("{", f"{{ CPPE_DEFINE_LOOP_PROPIGATOR_START({label}, void, &CPPE_propigate_helper_{state.labeled_depth - 1}, {state.labeled_depth});")\
-				.replace("CPPE_propigate_helper_0", "CPPE_propigate_0")
-			loopBody = rreplace(loopBody, "}", f"CPPE_DEFINE_LOOP_PROPIGATOR_END({label}, void) }};")
+			if state.labeled_depth - 1 > 0: parent = f"&CPPE_propigate_helper_{state.labeled_depth - 1}"
+			loopBody = f"{{ CPPE_DEFINE_LOOP_PROPIGATOR_START({label}, void, {parent}, {state.labeled_depth}); {collect} CPPE_DEFINE_LOOP_PROPIGATOR_END({label}, void) }};"
 
-		out = state.replace_child_in_output(str_or(out, node), body, loopBody)
+		out = yield from state.replace_child_in_output(node, body, loopBody, replacements)
 
 		bodyLine = " " #TODO: Implement
 		if label is not None: bodyLine = f"CPPE_DEFINE_LOOP_HELPER_PROPIGATOR({state.labeled_depth})" + bodyLine
 		conditionLine = "" #TODO: Implement
-		out = f"[&] ALWAYS_INLINE_LAMBDA {{ {bodyLine} auto CPPE_loop_body = {bodyText[0:-2]}; std::vector<decltype(CPPE_loop_body())> CPPE_out;\n{conditionLine}{extract_ending_indent(bodyText)}{out} return CPPE_out; }}()"
+		out = f"[&] ALWAYS_INLINE_LAMBDA {{ {bodyLine} auto CPPE_loop_body = {bodyText[0:-2]}; {declaration}\n{conditionLine}{extract_ending_indent(bodyText)}{out} return CPPE_out; }}()"
 
-	return out
+	return prefix + out
 
 
 def UFCS_macro(node, property = True, onPointer = False):
@@ -612,10 +1155,15 @@ def UFCS_macro(node, property = True, onPointer = False):
 	if onPointer: out += "_POINTER"
 	return out + ('_PROPERTY' if property else '_FUNCTION')
 
+# Translates an expression loop whose result is only ever counted (see process_standard_loop)
+def process_loop_count(state: NodeState):
+	if state.node.type == "for_range_loop": return (yield from process_range_for(state, None, "count"))
+	return (yield from process_standard_loop(state, None, None, "count"))
+
 def process_call_expression(state: NodeState):
 	node = state.node
 	if node.children[1].type == "noufcs":
-		return process_default_node(state).replace(process(state + node.children[1]), "", 1)
+		return (yield from process_default_node(state, [(node.children[1], "")]))
 
 	function = node.child_by_field_name("function")
 	arguments = node.child_by_field_name("arguments")
@@ -623,40 +1171,607 @@ def process_call_expression(state: NodeState):
 	onPointer = False
 	if function.type == "field_expression":
 		if function.children[2].type == "noufcs":
-			return process_default_node(state).replace(process(state + function.children[2]), "", 1)
+			return (yield from process_default_node(state, [(function.children[2], "")]))
 		argument1 = function.child_by_field_name("argument")
-		onPointer = "->" in process(state + function.children[1])
+		onPointer = "->" in (yield state + function.children[1])
 		function = function.child_by_field_name("field")
 
-	arguments = process(state + arguments)
+	argCount = len([child for child in arguments.named_children if child.type != "comment"])
+	# No need to collect the results of a loop just to find out how many there are
+	if argument1 is not None and argCount == 0 and not onPointer and (loop := expression_loop(argument1)) is not None and (yield state + function) == "size":
+		return (yield from process_loop_count(state + loop))
+	resolution = state.unit.resolve_ufcs(argument1, function, onPointer, arguments) if argument1 is not None else None
+	arguments = yield state + arguments
+	arguments = arguments[arguments.find("(") + 1:] # Everything after the opening parenthesis
 	if argument1 is not None:
-		arguments = arguments.replace("(", process(state + argument1) + ", ", 1).replace(", )", ")") #TODO: Need a regex to better match the no original arguments case...
-	else: arguments = arguments.replace("(", "", 1)
-	argCount = len(arguments.split(","))
-	
-	return f"{UFCS_macro(function, argCount == 1, onPointer)}({process(state + function)}, {arguments}"
+		if resolution == "member": return f"{(yield state + argument1)}{'->' if onPointer else '.'}{(yield state + function)}({arguments}"
+		arguments = (yield state + argument1) + (", " if argCount > 0 else "") + arguments
+		argCount += 1
+		if resolution == "free": return f"{(yield state + function)}({arguments}"
+
+	state.unit.use("ufcs.hpp")
+	return f"{UFCS_macro(function, argCount <= 1, onPointer)}({(yield state + function)}, {arguments}"
 
 def process_field_expression(state: NodeState):
 	node = state.node
 	if node.children[2].type == "noufcs":
-		return process_default_node(state).replace(process(state + node.children[2]), "")
-	
+		return (yield from process_default_node(state, [(node.children[2], "")]))
+
 	argument = node.child_by_field_name("argument")
-	onPointer = "->" in process(state + node.children[1])
+	onPointer = "->" in (yield state + node.children[1])
 	function = node.child_by_field_name("field")
-	return f"{UFCS_macro(function, True, onPointer)}({process(state + function)}, {process(state + argument)})"
-
+	if not onPointer and (loop := expression_loop(argument)) is not None and (yield state + function) == "size":
+		return (yield from process_loop_count(state + loop))
+	match state.unit.resolve_ufcs(argument, function, onPointer):
+		case "member": return f"{(yield state + argument)}{'->' if onPointer else '.'}{(yield state + function)}"
+		case "method": return f"{(yield state + argument)}{'->' if onPointer else '.'}{(yield state + function)}()"
+		case "free": return f"{(yield state + function)}({(yield state + argument)})"
+	state.unit.use("ufcs.hpp")
+	return f"{UFCS_macro(function, True, onPointer)}({(yield state + function)}, {(yield state + argument)})"
+
+
+# Handler for every type of node that needs more than its children translated (everything else is printed by process_default_node)
+HANDLERS = {
+	"product_type": process_product_type,
+	"sum_type": process_sum_type,
+	"array_type": process_array_type,
+	"function_definition": process_function, "inline_method_definition": process_function, "operator_cast_definition": process_function, #TODO: Does operator_cast work properly?
+	"lambda_expression": process_lambda,
+	"expression_body": process_expression_body,
+	"switch_statement": process_switch_try, "try_statement": process_switch_try,
+	"case_statement": process_switch_case,
+	"catch_clause": process_catch_clause,
+	"compound_expression": process_compound_expression,
+	"if_statement": process_if,
+	"for_statement": process_standard_loop, "while_statement": process_standard_loop, "do_statement": process_standard_loop,
+	"for_range_loop": process_range_for,
+	"labeled_expression": process_labeled_expression, "possibly_labeled_control_flow_expression": process_labeled_expression,
+	"labeled_statement": process_labeled_statement,
+	"return_statement": process_return_statement,
+	"yield_statement": process_yield_statement,
+	"defer_statement": process_defer_statement,
+	"break_statement": process_break_statement,
+	"continue_statement": process_continue_statement,
+	"call_expression": process_call_expression,
+	"field_expression": process_field_expression,
+}
+
+
+GLOBAL_SUBSTITUTIONS = { ";;": ";", "<-": "=" }
+GLOBAL_SUBSTITUTIONS_REGEX = re.compile("|".join(re.escape(key) for key in GLOBAL_SUBSTITUTIONS))
 
 def apply_global_substitutions(processed: str) -> str:
-	return processed.replace(";;", ";").replace("<-", "=")
-
-
-implementation = process(NodeState().with_node(tree.root_node))
-result = f"#include <{library}>\n\n"\
-	+ f"// Prototypes\n\n" + '\n'.join(set(prototypes)) + "\n\n"\
-	+"// Implementation\n\n\n" + apply_global_substitutions(implementation)
-
-if target is not None:
+	return GLOBAL_SUBSTITUTIONS_REGEX.sub(lambda match: GLOBAL_SUBSTITUTIONS[match.group(0)], processed) # NOTE: All substitutions happen in a single pass
+
+# Applies the global substitutions to text as it is written piece by piece (producing exactly what applying them to all of the text at once would)
+class SubstitutingWriter:
+	def __init__(self, out: typing.TextIO):
+		self.out = out
+		self.pending = "" # Tail of the text so far which could be the start of a substitution that continues in the next write
+
+	def write(self, text: str):
+		text = self.pending + text
+		keep = len(text) - (max(len(key) for key in GLOBAL_SUBSTITUTIONS) - 1)
+		out = []
+		start = 0
+		for match in GLOBAL_SUBSTITUTIONS_REGEX.finditer(text):
+			if match.start() >= keep: break
+			out.append(text[start:match.start()])
+			out.append(GLOBAL_SUBSTITUTIONS[match.group(0)])
+			start = match.end()
+		keep = max(keep, start)
+		out.append(text[start:keep])
+		self.out.write("".join(out))
+		self.pending = text[keep:]
+
+	def flush(self):
+		self.out.write(apply_global_substitutions(self.pending))
+		self.pending = ""
+
+
+# Translates the given CPPE source into C++
+def translate(parser: Parser, raw: bytes, library: str, statistics: collections.Counter | None = None, minimal_includes: bool = False) -> str:
+	out = io.StringIO()
+	translate_to(parser, raw, library, out, statistics, minimal_includes=minimal_includes)
+	return out.getvalue()
+
+# Streams the translation of the given CPPE source into out... each top-level declaration is written (and forgotten) as soon as it is processed
+# NOTE: When a prototypes header is provided it is included in place of the prototypes, returns the prototypes either way
+def translate_to(parser: Parser, raw: bytes, library: str, out: typing.TextIO, statistics: collections.Counter | None = None, prototypes_header: str | None = None, minimal_includes: bool = False) -> list[str]:
+	unit = TranslationUnit(raw, parser.parse(raw))
+	state = NodeState().with_unit(unit)
+	root = unit.tree.root_node
+	# NOTE: The implementation is spooled to disk since the prototypes it produces have to be written before it
+	with tempfile.TemporaryFile("w+", encoding="utf8", newline="") as implementation:
+		writer = SubstitutingWriter(implementation)
+		start = root.start_byte
+		for child in root.children:
+			writer.write(unit.source[start:child.start_byte])
+			writer.write(process(state + child))
+			unit.memo.clear() # Memoized nodes are only ever looked up again from within the same declaration
+			start = child.end_byte
+		writer.write(unit.source[start:root.end_byte])
+		writer.flush()
+
+		out.write(header(unit, library, prototypes_header, minimal_includes))
+		implementation.seek(0)
+		shutil.copyfileobj(implementation, out)
+	if statistics is not None: statistics.update(unit.statistics)
+	return list(unit.prototypes)
+
+# Everything that comes before the implementation: the include and prototypes it needs
+def header(unit: TranslationUnit, library: str, prototypes_header: str | None = None, minimal_includes: bool = False) -> str:
+	prototypes = '\n'.join(unit.prototypes) if prototypes_header is None else f'#include "{prototypes_header}"'
+	return (minimal_include(unit.features, library) if minimal_includes else f"#include <{library}>\n\n")\
+		+ f"// Prototypes\n\n" + prototypes + "\n\n"\
+		+"// Implementation\n\n\n"
+
+# Parts of the library in the order they have to be included (later ones use the macros of earlier ones)
+LIBRARY_HEADERS = ["ufcs.hpp", "defer.hpp", "product_sum.hpp", "control_flow.hpp"]
+
+# Includes of just the library and standard headers a translation uses, in place of the whole library (see --minimal-includes)
+def minimal_include(features: set[str], library: str) -> str:
+	directory = os.path.dirname(library)
+	out = [f"#include <{directory}/{name}>" for name in LIBRARY_HEADERS if name in features]
+	out += [f"#include {name}" for name in sorted(feature for feature in features if feature.startswith("<"))]
+	out += ["", "// Enables a more modern function syntax!", "#ifndef fn", "#define fn auto", "#endif"]
+	return "\n".join(out) + "\n\n"
+
+# Header holding the prototypes of many files, which each of their translations includes (see --header)
+def prototypes_header(library: str, prototypes: PrototypeTable) -> str:
+	return f"#pragma once\n#include <{library}>\n\n"\
+		+ f"// Prototypes\n\n" + '\n'.join(prototypes) + "\n"
+
+# Combines the processed implementation with the include and prototypes it needs
+def assemble(unit: TranslationUnit, implementation: str, library: str, minimal_includes: bool = False) -> str:
+	return header(unit, library, minimal_includes=minimal_includes) + apply_global_substitutions(implementation)
+
+# Keeps a file's tree and the translation of each of its top-level declarations around between edits,
+# so that only the declarations an edit touched have to be reparsed and reprocessed
+class IncrementalTranslation:
+	def __init__(self, parser: Parser, library: str, minimal_includes: bool = False):
+		self.parser = parser
+		self.library = library
+		self.minimal_includes = minimal_includes
+		self.raw = None
+		self.tree = None
+		self.cache = {} # (type, text) -> (output, prototypes added, features used, fingerprint of the symbols it relied on or None)
+		self.reprocessed = 0
+		self.reused = 0
+
+	def update(self, raw: bytes) -> str:
+		changed = None
+		if self.tree is None: tree = self.parser.parse(raw)
+		else:
+			start, oldEnd, newEnd = changed_byte_range(self.raw, raw)
+			self.tree.edit(start, oldEnd, newEnd, byte_to_point(self.raw, start), byte_to_point(self.raw, oldEnd), byte_to_point(raw, newEnd))
+			tree = self.parser.parse(raw, self.tree)
+			changed = [(r.start_byte, r.end_byte) for r in self.tree.get_changed_ranges(tree)] + [(start, newEnd)]
+
+		# Equivalent to process_default_node on the root... but declarations the edit didn't touch come from the cache
+		unit = TranslationUnit(raw, tree)
+		state = NodeState().with_unit(unit)
+		root = tree.root_node
+		cache = {}
+		out = []
+		start = root.start_byte
+		for child in root.children:
+			out.append(unit.source[start:child.start_byte])
+			key = (child.type, raw[child.start_byte:child.end_byte])
+			dirty = changed is None or any(s <= child.end_byte and child.start_byte <= e for s, e in changed)
+			# NOTE: Resolved UFCS calls depend on the classes (and functions) declared elsewhere in the file, so they are redone when those change
+			if not dirty and key in self.cache and self.cache[key][3] in [None, unit.symbols.fingerprint]:
+				text, prototypes, features, fingerprint = self.cache[key]
+				unit.prototypes.extend(prototypes)
+				self.reused += 1
+			else:
+				# NOTE: Each declaration records its features separately so they can be reused along with it
+				used, unit.features = unit.features, set()
+				before = len(unit.prototypes.added)
+				resolutions = unit.resolutions
+				text = process(state + child)
+				prototypes = unit.prototypes.added[before:]
+				features, unit.features = unit.features, used
+				fingerprint = unit.symbols.fingerprint if unit.resolutions > resolutions else None
+				self.reprocessed += 1
+			unit.features |= features
+			cache[key] = (text, prototypes, features, fingerprint)
+			out.append(text)
+			start = child.end_byte
+		out.append(unit.source[start:root.end_byte])
+
+		self.raw, self.tree, self.cache = raw, tree, cache
+		return assemble(unit, "".join(out), self.library, self.minimal_includes)
+
+def resolve_library(library: str) -> str:
+	library = os.path.abspath(library)
+	if "CPPE.hpp" not in library: library = os.path.join(library, "CPPE.hpp")
+	return library
+
+def target_name(path: str) -> str:
+	directory, filename = os.path.split(path)
+	return os.path.join(directory, filename.replace(".cppe", ".cpp").replace(".hppe", ".hpp"))
+
+# Expands the provided files, globs, and directories into a list of (source, path relative to the root of the tree) pairs
+def collect_sources(paths: list[str]) -> list[tuple[str, str]]:
+	sources = []
+	for path in paths:
+		if os.path.isdir(path):
+			for root, dirs, files in os.walk(path):
+				dirs.sort()
+				sources.extend(os.path.join(root, f) for f in sorted(files) if os.path.splitext(f)[1] in SOURCE_EXTENSIONS)
+		elif glob.has_magic(path):
+			sources.extend(sorted(f for f in glob.glob(path, recursive=True) if os.path.isfile(f)))
+		else: sources.append(path)
+	sources = list(dict.fromkeys(os.path.abspath(source) for source in sources)) # Remove duplicates (preserving order)
+	if len(sources) == 0: return []
+
+	# Outputs mirror the directory structure below the deepest directory common to all of the inputs
+	roots = []
+	for path in paths:
+		path = os.path.abspath(path)
+		while glob.has_magic(path): path = os.path.dirname(path) # Globs are rooted at their first non-wildcard directory
+		roots.append(path if os.path.isdir(path) else os.path.dirname(path))
+	root = os.path.commonpath(roots)
+	return [(source, os.path.relpath(source, root)) for source in sources]
+
+def create_parser(grammarDir: str = GRAMMAR_DIR) -> Parser:
+	parser = Parser()
+	parser.set_language(load_language(grammarDir))
+	return parser
+
+# Parsers are only ever created once per process (per grammar), the first time something needs one
+parsers: dict[str, Parser] = {}
+
+def shared_parser(grammarDir: str = GRAMMAR_DIR) -> Parser:
+	grammarDir = os.path.abspath(grammarDir)
+	if grammarDir not in parsers: parsers[grammarDir] = create_parser(grammarDir)
+	return parsers[grammarDir]
+
+# Entry point for using the translator from Python (the CLI is a thin wrapper around it)
+# NOTE: Nothing is loaded until the first translation, so creating one is free
+class Translator:
+	def __init__(self, grammarDir: str = GRAMMAR_DIR, library: str = DEFAULT_LIBRARY, minimal_includes: bool = False, cache: TranslationCache | None = None):
+		self.grammarDir = grammarDir
+		self.library = resolve_library(library)
+		self.minimal_includes = minimal_includes
+		self.cache = cache # NOTE: Only used for whole files (see translate_file)
+		self.statistics = collections.Counter() # Accumulated over every translation
+
+	@property
+	def parser(self) -> Parser:
+		return shared_parser(self.grammarDir)
+
+	def translate(self, source: bytes | str, *, library: str | None = None) -> str:
+		if isinstance(source, str): source = source.encode("utf8")
+		return translate(self.parser, source, self.resolve(library), self.statistics, self.minimal_includes)
+
+	# Streams the translation into out, returning its prototypes (see translate_to)
+	def translate_to(self, source: bytes | str, out: typing.TextIO, *, library: str | None = None, prototypes_header: str | None = None) -> list[str]:
+		if isinstance(source, str): source = source.encode("utf8")
+		return translate_to(self.parser, source, self.resolve(library), out, self.statistics, prototypes_header, self.minimal_includes)
+
+	# Translates a file into the target, returning (whether the target changed, error message or None, statistics, prototypes) (see translate_file)
+	# NOTE: Hits in the cache are copied from it without parsing anything (or even loading the grammar)
+	def translate_file(self, source: str, target: str, *, library: str | None = None, prototypes_header: str | None = None) -> tuple[bool, str | None, collections.Counter, list[str]]:
+		library = self.resolve(library)
+		key = None
+		if self.cache is not None:
+			try:
+				with open(source, "rb") as f:
+					key = self.cache.key(f.read(), { "library": [os.path.basename(library), library_hash(library)], "header": prototypes_header, "minimal_includes": self.minimal_includes })
+				hit = self.cache.lookup(key)
+			except OSError: hit = None # translate_file reports what went wrong
+			if hit is not None:
+				cached, prototypes = hit
+				try:
+					result = copy_file(cached, target, (LIBRARY_PLACEHOLDER, os.path.dirname(library))), None, collections.Counter({ "shared cache hits": 1 }), prototypes
+					self.statistics.update(result[2])
+					return result
+				except OSError: pass # Evicted by another process since the lookup... so it is translated like any other miss
+
+		result = translate_file(self.parser, source, library, target, prototypes_header, self.minimal_includes)
+		if key is not None:
+			result[2]["shared cache misses"] += 1
+			if result[1] is None:
+				try: self.cache.store(key, target, result[3], library)
+				except OSError: pass # The cache might be read only (or full), the translation still succeeded
+		self.statistics.update(result[2])
+		return result
+
+	# Translation of a single file which is kept up to date as it is edited (see IncrementalTranslation)
+	def incremental(self, *, library: str | None = None) -> "IncrementalTranslation":
+		return IncrementalTranslation(self.parser, self.resolve(library), self.minimal_includes)
+
+	def resolve(self, library: str | None) -> str:
+		return self.library if library is None else resolve_library(library)
+
+# Translates the given file into the target, returning (whether the target changed, None, statistics, prototypes) on success or (False, error message, statistics, []) on failure
+# NOTE: The translation is streamed into a temporary file which then replaces the target, so the target is never left half written
+def translate_file(parser: Parser, source: str, library: str, target: str, prototypes_header: str | None = None, minimal_includes: bool = False) -> tuple[bool, str | None, collections.Counter, list[str]]:
+	statistics = collections.Counter()
+	temporary = f"{target}.{os.getpid()}.tmp"
+	try:
+		with open(source) as f:
+			raw = f.read().encode("utf8")
+		os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+		with open(temporary, "w") as out:
+			prototypes = translate_to(parser, raw, library, out, statistics, prototypes_header, minimal_includes)
+		return replace_if_changed(temporary, target), None, statistics, prototypes
+	except Exception:
+		return False, traceback.format_exc(), statistics, []
+	finally:
+		if os.path.exists(temporary): os.remove(temporary)
+
+# Each worker process keeps its own translator (and so warm parser) for every file it is handed
+worker_translator: Translator | None = None
+
+def init_worker(grammarDir: str, grammarHash: str, library: str, minimal_includes: bool, cache: TranslationCache | None):
+	global worker_translator
+	grammar.hashes[os.path.abspath(grammarDir)] = grammarHash # Already hashed by the main process
+	worker_translator = Translator(grammarDir, library, minimal_includes, cache)
+
+def translate_file_in_worker(source: str, target: str, prototypes_header: str | None) -> tuple[bool, str | None, collections.Counter, list[str]]:
+	return worker_translator.translate_file(source, target, prototypes_header=prototypes_header)
+
+# Version recorded in the manifests, includes a hash of the translator's source so edits to it invalidate old outputs
+def translator_version() -> str:
+	h = hashlib.sha256()
+	for module in [__file__, helpers.__file__]:
+		with open(module, "rb") as f:
+			h.update(f.read())
+	return f"{__version__}+{h.hexdigest()[:16]}"
+
+# Record (stored in each output directory) of the inputs every output in that directory was generated from
+class Manifest:
+	def __init__(self, directory: str):
+		self.path = os.path.join(directory, MANIFEST_NAME)
+		self.entries = {}
+		self.dirty = False
+		try:
+			with open(self.path) as f:
+				self.entries = json.load(f)
+		except (OSError, ValueError): pass # Missing or corrupt manifests simply mean everything gets rebuilt
+
+	def is_current(self, target: str, key: dict) -> bool:
+		entry = self.entries.get(os.path.basename(target))
+		if entry is None: return False
+		return { name: value for name, value in entry.items() if name != "prototypes" } == key and os.path.exists(target)
+
+	# NOTE: Prototypes are only recorded when they are shared through a header (so up to date files can still contribute theirs)
+	def record(self, target: str, key: dict, prototypes: list[str] | None = None):
+		self.entries[os.path.basename(target)] = key | ({ "prototypes": prototypes } if prototypes is not None else {})
+		self.dirty = True
+
+	def prototypes(self, target: str) -> list[str]:
+		return self.entries.get(os.path.basename(target), {}).get("prototypes", [])
+
+	def save(self):
+		if not self.dirty: return
+		temporary = f"{self.path}.{os.getpid()}.tmp"
+		with open(temporary, "w") as f:
+			json.dump(self.entries, f, indent="\t", sort_keys=True)
+		os.replace(temporary, self.path)
+		self.dirty = False
+
+# Writes the text to the target, unless the target already holds exactly that text (so its mtime is left alone!)
+def write_if_changed(target: str, text: str) -> bool:
+	try:
+		with open(target) as f:
+			if f.read() == text: return False
+	except OSError: pass
+	os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
 	with open(target, "w") as f:
-		f.write(result)
-if args.print: print(result)
+		f.write(text)
+	return True
+
+# Copies the file over the target (through a temporary, see replace_if_changed), returning whether the target changed
+# NOTE: library is a (placeholder, directory) pair, the placeholder in the includes at the top of the file is swapped for the library's actual directory (see TranslationCache.store)
+def copy_file(source: str, target: str, library: tuple[str, str] | None = None) -> bool:
+	temporary = f"{target}.{os.getpid()}.tmp"
+	try:
+		os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+		if library is None: shutil.copyfile(source, temporary)
+		else:
+			with open(source, newline="") as f:
+				text = relocate(f.read(), *library)
+			with open(temporary, "w", newline="") as f:
+				f.write(text)
+		return replace_if_changed(temporary, target)
+	finally:
+		if os.path.exists(temporary): os.remove(temporary)
+
+# Moves the temporary over the target, unless the target already holds exactly the same text (so its mtime is left alone!)
+def replace_if_changed(temporary: str, target: str) -> bool:
+	if os.path.exists(target) and filecmp.cmp(temporary, target, shallow=False):
+		os.remove(temporary)
+		return False
+	os.replace(temporary, target)
+	return True
+
+def print_file(path: str):
+	with open(path) as f:
+		shutil.copyfileobj(f, sys.stdout)
+	print()
+
+# Where the translation of the given source should be written (None if it should only be printed)
+def target_for(args: argparse.Namespace, singleOutput: bool, source: str, relative: str) -> str | None:
+	if singleOutput: return args.output
+	if args.output is not None: return os.path.join(args.output, target_name(relative))
+	if not args.print: return target_name(source)
+	return None
+
+# Retranslates files whenever they change, reparsing and reprocessing only what each edit touched
+def watch(args: argparse.Namespace, translator: Translator, singleOutput: bool, inputs: dict) -> int:
+	files = {} # source -> (mtime, IncrementalTranslation)
+	try:
+		while True:
+			for source, relative in collect_sources(args.filenames): # NOTE: Recollected so new files get picked up
+				try: mtime = os.stat(source).st_mtime_ns
+				except OSError: continue # Deleted (or mid-save)
+				if source in files and files[source][0] == mtime: continue
+
+				start = time.perf_counter()
+				translation = files[source][1] if source in files else translator.incremental()
+				files[source] = (mtime, translation)
+				try:
+					with open(source) as f:
+						raw = f.read().encode("utf8")
+					if raw == translation.raw: continue
+					reprocessed, reused = translation.reprocessed, translation.reused
+					result = translation.update(raw)
+				except Exception:
+					translation.tree = None # Start from scratch next time
+					print(f"Failed to translate {source}:\n{traceback.format_exc()}", file=sys.stderr)
+					continue
+
+				target = target_for(args, singleOutput, source, relative)
+				if target is not None:
+					write_if_changed(target, result)
+					manifest = Manifest(os.path.dirname(os.path.abspath(target)))
+					manifest.record(target, { "source": hashlib.sha256(raw).hexdigest() } | inputs)
+					manifest.save()
+				if args.print: print(result)
+				print(f"translated {source} in {(time.perf_counter() - start) * 1000:.2f}ms "
+					+ f"({translation.reprocessed - reprocessed} declaration(s) reprocessed, {translation.reused - reused} reused)", file=sys.stderr)
+			time.sleep(args.interval)
+	except KeyboardInterrupt:
+		return 0
+
+def main(argv: list[str] | None = None) -> int:
+	global profiler
+	args = arg_parser.parse_args(argv)
+	if args.profile is not None:
+		profiler = Profiler(trace=args.profile == "chrome")
+		args.jobs = 1 # Workers wouldn't report back to our profiler
+	library = resolve_library(args.library)
+	if args.minimal_includes and args.precompile is not None: arg_parser.error("--minimal-includes can't be used with --precompile (which always includes the whole library)")
+	if args.minimal_includes and args.header is not None: arg_parser.error("--minimal-includes can't be used with --header (whose prototypes may need any part of the library)")
+	if args.precompile is not None:
+		compiler, *flags = shlex.split(args.precompile)
+		precompiled = precompile(library, compiler, flags)
+		library = precompiled.header
+		print(f"outputs include a precompiled ({precompiled.kind}) CPPE library, compile them with: {shlex.join([compiler, *flags, *precompiled.flags])}", file=sys.stderr)
+	sources = collect_sources(args.filenames)
+	if len(sources) == 0 and not args.watch:
+		print("No CPPE files found!", file=sys.stderr)
+		return 1
+	# When a single file is explicitly provided the output is a file... otherwise it is a directory to mirror the inputs into
+	singleOutput = args.output is not None and len(args.filenames) == 1 and os.path.isfile(args.filenames[0])
+
+	inputs = { "library": library, "grammar": grammar.grammar_hash(args.grammar), "version": translator_version() }
+	if args.header is not None: inputs["header"] = os.path.abspath(args.header)
+	if args.minimal_includes: inputs["minimal_includes"] = True
+	cache = None
+	if args.cache is not None:
+		# NOTE: Where the library and header are stays out of the cache's inputs, each file's key has the library's hash and the header's (relative) include instead
+		try: cache = TranslationCache(args.cache, parse_size(args.cache_size), { name: value for name, value in inputs.items() if name not in ["library", "header"] })
+		except ValueError as e: arg_parser.error(str(e))
+
+	parserStart = time.perf_counter()
+	translator = Translator(args.grammar, library, args.minimal_includes, cache)
+	# NOTE: Also makes sure the grammar is cached before any workers look for it... unless the translations might all come from the cache
+	if cache is None: translator.parser
+	parserTime = time.perf_counter() - parserStart - grammar.timings.get("build", 0) - grammar.timings.get("load", 0) # The grammar was already hashed for the inputs
+	startupTime = time.perf_counter() - startupStart
+	if args.watch:
+		if args.header is not None: arg_parser.error("--header can't be used with --watch")
+		return watch(args, translator, singleOutput, inputs)
+
+	# Figure out which files actually need to be translated
+	manifests = {}
+	pending = []
+	errors = []
+	prototypes = {} # Source -> its prototypes (only needed when they are shared through a header)
+	for source, relative in sources:
+		target = target_for(args, singleOutput, source, relative)
+		key = None
+		if target is not None:
+			directory = os.path.dirname(os.path.abspath(target))
+			if directory not in manifests: manifests[directory] = Manifest(directory)
+			try:
+				with open(source, "rb") as f:
+					key = { "source": hashlib.sha256(f.read()).hexdigest() } | inputs
+			except OSError as e: # NOTE: Reported along with the other failures, the remaining files are still translated
+				errors.append((source, f"{e}\n"))
+				continue
+			prototypes[source] = manifests[directory].prototypes(target)
+			if not args.force and not args.print and manifests[directory].is_current(target, key):
+				continue
+		pending.append((source, target, key))
+	jobs = max(min(args.jobs if args.jobs > 0 else os.cpu_count() or 1, len(pending)), 1)
+
+	# Translations which are only printed are written somewhere temporary first
+	scratch = tempfile.mkdtemp(prefix="cppe-") if any(target is None for _, target, _ in pending) else None
+	outputs = [target if target is not None else os.path.join(scratch, f"{i}.cpp") for i, (_, target, _) in enumerate(pending)]
+	# Each output includes the shared header relative to wherever it ends up
+	includes = [None] * len(pending)
+	if args.header is not None:
+		includes = [(os.path.relpath(os.path.abspath(args.header), os.path.dirname(os.path.abspath(target))) if target is not None else os.path.abspath(args.header)).replace(os.sep, "/")
+			for _, target, _ in pending]
+
+	if jobs > 1:
+		executor = concurrent.futures.ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(args.grammar, inputs["grammar"], library, args.minimal_includes, cache))
+		results = executor.map(translate_file_in_worker, [source for source, _, _ in pending], outputs, includes)
+	else:
+		executor = None
+		results = (translator.translate_file(source, output, prototypes_header=include) for (source, _, _), output, include in zip(pending, outputs, includes))
+
+	# Results are consumed (and thus printed) in the order the sources were provided, no matter which worker finishes first
+	unreadable = len(errors)
+	written = 0
+	statistics = collections.Counter()
+	for (source, target, key), output, (changed, error, fileStatistics, fileprototypes) in zip(pending, outputs, results):
+		statistics.update(fileStatistics)
+		if error is not None:
+			errors.append((source, error))
+			continue
+
+		prototypes[source] = fileprototypes
+		if target is not None:
+			written += changed
+			manifests[os.path.dirname(os.path.abspath(target))].record(target, key, fileprototypes if args.header is not None else None)
+		if args.print: print_file(output)
+	if executor is not None: executor.shutdown()
+	if scratch is not None: shutil.rmtree(scratch, ignore_errors=True)
+	for manifest in manifests.values(): manifest.save()
+
+	if args.header is not None:
+		shared = PrototypeTable()
+		for source, _ in sources: shared.extend(prototypes.get(source, [])) # NOTE: Files which failed keep contributing their last prototypes
+		write_if_changed(args.header, prototypes_header(library, shared))
+
+	if cache is not None:
+		cache.record(statistics["shared cache hits"], statistics["shared cache misses"])
+		if statistics["shared cache misses"] > 0: cache.trim() # Only new entries can have pushed the cache over its size
+
+	for source, error in errors:
+		print(f"Failed to translate {source}:\n{error}", file=sys.stderr)
+
+	if profiler is not None:
+		report = { "table": profiler.table, "json": profiler.json, "chrome": profiler.chrome_trace }[args.profile]()
+		if args.profile_output is None and args.profile == "table": print(report, file=sys.stderr)
+		else:
+			output = args.profile_output or ("cppe-profile.json" if args.profile == "json" else "cppe-trace.json")
+			with open(output, "w") as f:
+				f.write(report)
+
+	if args.timings:
+		print(f"startup: imports {importTime * 1000:.2f}ms, grammar hash {grammar.timings.get('hash', 0) * 1000:.2f}ms, "
+			+ f"grammar build {grammar.timings.get('build', 0) * 1000:.2f}ms, grammar load {grammar.timings.get('load', 0) * 1000:.2f}ms, "
+			+ f"parser {parserTime * 1000:.2f}ms, total {startupTime * 1000:.2f}ms", file=sys.stderr)
+		print(f"translated {len(pending) - (len(errors) - unreadable)}/{len(sources)} file(s) ({len(sources) - len(pending) - unreadable} up to date, {written} rewritten) "
+			+ f"with {jobs} job(s) in {(time.perf_counter() - startupStart - startupTime) * 1000:.2f}ms", file=sys.stderr)
+		lookups = statistics["memo hits"] + statistics["memo misses"]
+		print(f"memo: {statistics['memo hits']} hits, {statistics['memo misses']} misses"
+			+ (f" ({statistics['memo hits'] / lookups * 100:.1f}% hit rate)" if lookups > 0 else ""), file=sys.stderr)
+		if statistics["ufcs resolved"] + statistics["ufcs macros"] > 0:
+			print(f"ufcs: {statistics['ufcs resolved']} resolved statically, {statistics['ufcs macros']} left to the macros", file=sys.stderr)
+		if cache is not None:
+			lifetime = cache.stats()
+			print(f"shared cache ({cache.directory}): {statistics['shared cache hits']} hits, {statistics['shared cache misses']} misses "
+				+ f"({lifetime['hits']} hits, {lifetime['misses']} misses over its lifetime)", file=sys.stderr)
+	return 1 if len(errors) > 0 else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
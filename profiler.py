@@ -0,0 +1,59 @@
+import json, time
+
+# Records how much time (and output) the translator spends on each type of node
+class Profiler:
+	def __init__(self, trace: bool = False):
+		self.stats = {} # type -> [calls, cumulative seconds, self seconds, output bytes]
+		self.max_depth = 0
+		self.starts = [] # When each node currently being processed started
+		self.children = [] # Time spent in the children of each node currently being processed
+		self.trace = trace
+		self.events = []
+		self.start = time.perf_counter()
+
+	# Called by process as it starts translating a node...
+	def enter(self):
+		self.starts.append(time.perf_counter())
+		self.children.append(0.0)
+		self.max_depth = max(self.max_depth, len(self.starts))
+
+	# ... and once it has that node's translation
+	def exit(self, type: str, out: str):
+		start = self.starts.pop()
+		elapsed = time.perf_counter() - start
+		childTime = self.children.pop()
+		if len(self.children) > 0: self.children[-1] += elapsed
+
+		size = len(out.encode("utf8"))
+		stat = self.stats.setdefault(type, [0, 0.0, 0.0, 0])
+		stat[0] += 1
+		stat[1] += elapsed # NOTE: Nodes nested within nodes of the same type are counted more than once
+		stat[2] += elapsed - childTime
+		stat[3] += size
+		if self.trace:
+			self.events.append({ "name": type, "ph": "X", "pid": 0, "tid": 0,
+				"ts": (start - self.start) * 1e6, "dur": elapsed * 1e6, "args": { "bytes": size } })
+
+	# Forgets the given number of nodes whose translation failed part way through
+	def abandon(self, count: int):
+		if count <= 0: return
+		del self.starts[-count:]
+		del self.children[-count:]
+
+	def table(self) -> str:
+		lines = [f"{'node type':<45}{'calls':>10}{'cumulative ms':>15}{'self ms':>12}{'output bytes':>15}"]
+		for type, (calls, cumulative, self_, bytes) in sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True):
+			lines.append(f"{type:<45}{calls:>10}{cumulative * 1000:>15.2f}{self_ * 1000:>12.2f}{bytes:>15}")
+		lines.append(f"maximum nesting depth: {self.max_depth}")
+		return "\n".join(lines)
+
+	def json(self) -> str:
+		return json.dumps({
+			"max_depth": self.max_depth,
+			"types": { type: { "calls": calls, "cumulative": cumulative, "self": self_, "bytes": bytes }
+				for type, (calls, cumulative, self_, bytes) in self.stats.items() }
+		}, indent="\t")
+
+	# Trace in the Chrome trace event format (viewable in chrome://tracing or Perfetto)
+	def chrome_trace(self) -> str:
+		return json.dumps({ "traceEvents": self.events, "displayTimeUnit": "ms" })
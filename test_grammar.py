@@ -0,0 +1,30 @@
+# Tests for hashing the grammar's sources (see grammar.grammar_hash)
+import os, pytest
+import grammar
+
+@pytest.fixture
+def grammar_dir(tmp_path, monkeypatch):
+	monkeypatch.setenv("CPPE_CACHE_DIR", str(tmp_path / "cache"))
+	monkeypatch.setattr(grammar, "hashes", {})
+	src = tmp_path / "grammar" / "src"
+	src.mkdir(parents=True)
+	(src / "parser.c").write_text("int parser;\n")
+	return str(tmp_path / "grammar")
+
+def test_hashed_once_per_process(grammar_dir, monkeypatch):
+	key = grammar.grammar_hash(grammar_dir)
+	monkeypatch.setattr(grammar.os, "walk", None) # Anything but the remembered hash would fail now
+	assert grammar.grammar_hash(grammar_dir) == key
+
+def test_unchanged_sources_are_not_read_again(grammar_dir, monkeypatch):
+	parser = os.path.join(grammar_dir, "src", "parser.c")
+	key = grammar.grammar_hash(grammar_dir)
+	stat = os.stat(parser)
+	with open(parser, "w") as f: f.write("int PARSER;\n") # Same size and (restored) modification time, only reading it could tell
+	os.utime(parser, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+	monkeypatch.setattr(grammar, "hashes", {})
+	assert grammar.grammar_hash(grammar_dir) == key
+
+	os.utime(parser, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+	monkeypatch.setattr(grammar, "hashes", {})
+	assert grammar.grammar_hash(grammar_dir) != key
@@ -0,0 +1,23 @@
+# Regression tests for labeled break/continue, lowered to gotos or propagated out of lambdas (see process_standard_loop)
+import re
+from preprocess import Translator
+
+# Translates a function with the given body, returning what its definition became
+def translate_function(translator: Translator, body: str) -> str:
+	out = translator.translate(f"int f(int a) {{\n\tint c = a;\n{body}\n\treturn a;\n}}\n")
+	return out[out.rindex("int f("):]
+
+def test_goto_break_stays_in_loop_body(translator):
+	out = translate_function(translator, "\twhile (a) outer: for (int i = 0; i < a; i++) { if (i) break outer; a--; }")
+	assert "goto CPPE_break_outer;" in out
+	assert re.search(r"while \(a\) \{ outer: for .*CPPE_break_outer:; \}", out, re.DOTALL)
+
+def test_goto_break_keeps_else_attached(translator):
+	out = translate_function(translator, "\tif (c) outer: for (int i = 0; i < a; i++) { if (i) continue outer; if (a) break outer; a--; } else a++;")
+	assert "goto CPPE_break_outer;" in out and "goto CPPE_continue_outer;" in out
+	assert re.search(r"if \(c\) \{ outer: for .*CPPE_continue_outer:; \} CPPE_break_outer:; \} else a\+\+;", out, re.DOTALL)
+
+def test_propagated_break_stays_in_loop_body(translator):
+	out = translate_function(translator, "\twhile (a) outer: for (int i = 0; i < a; i++) { int v = if (i) { break outer; } else { 1 }; a -= v; }")
+	assert "goto" not in out and "CPPE_BREAK(outer" in out
+	assert re.search(r"while \(a\) outer: for .*CPPE_DEFINE_LOOP_PROPIGATOR_AND_HELPER_START\(outer,", out, re.DOTALL)
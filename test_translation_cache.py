@@ -0,0 +1,42 @@
+# Tests for the translations shared between checkouts (see TranslationCache)
+import os, shutil, pytest
+from preprocess import Translator, DEFAULT_LIBRARY, LIBRARY_PLACEHOLDER, copy_file
+from translation_cache import TranslationCache
+
+SOURCE = "struct S { int x; };\nint main() { S s; return s.y; }\n"
+
+# Copies of the library in two checkouts at different paths
+@pytest.fixture
+def roots(tmp_path) -> list[str]:
+	roots = [str(tmp_path / "a"), str(tmp_path / "b")]
+	for root in roots:
+		shutil.copytree(os.path.dirname(DEFAULT_LIBRARY), os.path.join(root, "library"), ignore=shutil.ignore_patterns("__pycache__"))
+		with open(os.path.join(root, "main.cppe"), "w") as f: f.write(SOURCE)
+	return roots
+
+@pytest.mark.parametrize("minimal_includes", [False, True])
+def test_checkouts_share_entries(translator, roots, tmp_path, minimal_includes):
+	cache = TranslationCache(str(tmp_path / "cache"))
+	outputs, statistics = [], []
+	for root in roots:
+		checkout = Translator(translator.grammarDir, os.path.join(root, "library", "CPPE.hpp"), minimal_includes, cache)
+		_, error, stats, _ = checkout.translate_file(os.path.join(root, "main.cppe"), os.path.join(root, "main.cpp"))
+		assert error is None
+		with open(os.path.join(root, "main.cpp")) as f: outputs.append(f.read())
+		statistics.append(stats)
+	assert statistics[0]["shared cache misses"] == 1 and statistics[1]["shared cache hits"] == 1
+	assert f"#include <{os.path.join(roots[1], 'library')}" in outputs[1] and roots[0] not in outputs[1]
+	assert outputs[1] == outputs[0].replace(roots[0], roots[1])
+
+def test_entries_are_stored_without_the_library_path(roots, tmp_path):
+	cache = TranslationCache(str(tmp_path / "cache"))
+	output = os.path.join(roots[0], "main.cpp")
+	with open(output, "w") as f: f.write(f"#include <{os.path.join(roots[0], 'library')}/ufcs.hpp>\n\n// Implementation\n\n\n#include <{roots[0]}/other.hpp>\n")
+	cache.store("0" * 64, output, [], os.path.join(roots[0], "library", "CPPE.hpp"))
+	cached, _ = cache.lookup("0" * 64)
+	with open(cached) as f: assert roots[0] not in f.read().split("// Implementation")[0]
+
+	target = os.path.join(roots[1], "main.cpp")
+	copy_file(cached, target, (LIBRARY_PLACEHOLDER, os.path.join(roots[1], "library")))
+	with open(target) as f: # Only the includes of the library are relocated
+		assert f.read() == f"#include <{os.path.join(roots[1], 'library')}/ufcs.hpp>\n\n// Implementation\n\n\n#include <{roots[0]}/other.hpp>\n"
@@ -0,0 +1,34 @@
+# Regression tests for the UFCS calls resolved without the CPPE_UFCS macros (see SymbolTable.resolve_ufcs)
+from preprocess import Translator
+
+# Translates the statements in a main function following the declarations, returning what main became
+def translate_main(translator: Translator, declarations: str, statements: str) -> str:
+	out = translator.translate(f"{declarations}\nint main() {{\n{statements}\n}}\n")
+	return out[out.rindex("int main()"):]
+
+def test_mismatched_arity_keeps_macro(translator):
+	out = translate_main(translator, "struct S { int get(int a); void print(); };\nint get(S s);\nvoid print(S s, int a);", "S s;\nint g = s.get;\ns.print(5);")
+	assert "s.get()" not in out and "CPPE_UFCS_PROPERTY(get, s)" in out
+	assert "s.print(5)" not in out and "CPPE_UFCS_FUNCTION(print, s, 5)" in out
+
+def test_private_member_keeps_macro(translator):
+	out = translate_main(translator, "class C { int helper(); public: int run(); };\nint helper(C c);", "C c;\nc.helper();\nc.run();")
+	assert "c.helper()" not in out and "CPPE_UFCS_PROPERTY(helper, c)" in out
+	assert "c.run()" in out
+
+def test_viable_members_resolve(translator):
+	out = translate_main(translator, "struct P { int x; int len() const; int many(int a, int b); };", "P p;\nconst P& r = p;\nint a = p.x + r.len() + p.len;\np.many(1, 2);")
+	assert "p.x + r.len() + p.len()" in out and "p.many(1, 2)" in out
+
+def test_uncertain_members_keep_macro(translator):
+	out = translate_main(translator, "struct Q { int bump(); int opt(int a = 1); int over(); int over(int a); };", "const Q q;\nq.bump();\nQ o;\no.opt(1);\no.over();")
+	assert "CPPE_UFCS_PROPERTY(bump, q)" in out and "CPPE_UFCS_FUNCTION(opt, o, 1)" in out and "CPPE_UFCS_PROPERTY(over, o)" in out
+
+def test_free_function_needs_whole_file(translator):
+	declarations = "struct S {};\nint f(S s);"
+	assert "f(s);" in translate_main(translator, declarations, "S s;\ns.f();")
+	assert "CPPE_UFCS_PROPERTY(f, s)" in translate_main(translator, f"#include \"other.hpp\"\n{declarations}", "S s;\ns.f();")
+
+def test_copy_captures_are_const(translator):
+	out = translate_main(translator, "struct S { int n(); int c() const; };", "S s;\nauto a = [=] { return s.n() + s.c(); };\nauto b = [s] { return s.n(); };\nauto c = [&s] { return s.n(); };\nauto d = [s] () mutable { return s.n(); };")
+	assert out.count("CPPE_UFCS_PROPERTY(n, s)") == 2 and out.count("s.n()") == 2 and "s.c()" in out
@@ -0,0 +1,129 @@
+import hashlib, json, os, re, shutil, uuid
+
+DEFAULT_MAX_SIZE = 1024 ** 3
+STATS_NAME = "stats.json"
+# Stands in for the library's directory in the includes of cached outputs (see relocate)
+LIBRARY_PLACEHOLDER = "@CPPE_LIBRARY@"
+
+# Library directory -> hash of its headers, every library is only hashed once per process (see library_hash)
+library_hashes: dict[str, str] = {}
+
+# Parses sizes like 500M or 2G (plain numbers are bytes)
+def parse_size(size: str) -> int:
+	match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", size, re.IGNORECASE)
+	if match is None: raise ValueError(f"Invalid size: {size}")
+	return int(float(match.group(1)) * 1024 ** " KMGT".index(match.group(2).upper() or " "))
+
+# Hash of the library's headers... what the library is rather than where it is, so checkouts anywhere can share translations
+def library_hash(library: str) -> str:
+	directory = os.path.dirname(os.path.abspath(library))
+	if directory in library_hashes: return library_hashes[directory]
+	h = hashlib.sha256()
+	for root, dirs, files in os.walk(directory):
+		dirs.sort() # Make sure the walk order (and thus the hash) is stable
+		for name in sorted(files):
+			if os.path.splitext(name)[1] not in [".h", ".hpp"]: continue
+			path = os.path.join(root, name)
+			h.update(os.path.relpath(path, directory).replace(os.sep, "/").encode("utf8") + b"\0")
+			with open(path, "rb") as f:
+				h.update(f.read())
+	library_hashes[directory] = h.hexdigest()
+	return library_hashes[directory]
+
+# Swaps the directory the includes at the top of an output (up to its implementation) reference the library through
+def relocate(text: str, old: str, new: str) -> str:
+	lines = text.split("\n")
+	for i, line in enumerate(lines):
+		if line.startswith("// Implementation"): break
+		if line.startswith(f"#include <{old}"): lines[i] = f"#include <{new}" + line[len(f"#include <{old}"):]
+	return "\n".join(lines)
+
+# Translations shared between checkouts (and machines, when the directory is a shared mount), addressed by everything that influences them
+# NOTE: Entries are written to a temporary and then moved into place... with the prototypes last, so an entry only exists once it is complete
+class TranslationCache:
+	def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE, inputs: dict | None = None):
+		self.directory = os.path.abspath(directory)
+		self.max_size = max_size
+		self.inputs = inputs or {} # Everything besides the source which the translations depend on (grammar, version, ...)
+
+	def key(self, raw: bytes, options: dict | None = None) -> str:
+		h = hashlib.sha256(hashlib.sha256(raw).digest())
+		h.update(json.dumps(self.inputs | (options or {}), sort_keys=True).encode("utf8"))
+		return h.hexdigest()
+
+	def paths(self, key: str) -> tuple[str, str]:
+		base = os.path.join(self.directory, key[:2], key)
+		return base + ".cpp", base + ".json"
+
+	# Returns (path of the cached output, its prototypes) or None on a miss
+	def lookup(self, key: str) -> tuple[str, list[str]] | None:
+		output, description = self.paths(key)
+		try:
+			with open(description) as f:
+				prototypes = json.load(f)["prototypes"]
+			os.utime(output) # Entries are evicted least recently used first
+			os.utime(description)
+		except (OSError, ValueError, KeyError): return None
+		return output, prototypes
+
+	# Copies the output (which includes the given library) into the cache, with the library's directory replaced by LIBRARY_PLACEHOLDER
+	def store(self, key: str, output: str, prototypes: list[str], library: str):
+		cached, description = self.paths(key)
+		os.makedirs(os.path.dirname(cached), exist_ok=True)
+		suffix = f".{os.getpid()}-{uuid.uuid4().hex}.tmp"
+		try:
+			with open(output, newline="") as f:
+				text = relocate(f.read(), os.path.dirname(library), LIBRARY_PLACEHOLDER)
+			with open(cached + suffix, "w", newline="") as f:
+				f.write(text)
+			os.replace(cached + suffix, cached)
+			with open(description + suffix, "w") as f:
+				json.dump({ "prototypes": prototypes }, f)
+			os.replace(description + suffix, description)
+		finally:
+			for temporary in [cached + suffix, description + suffix]:
+				if os.path.exists(temporary): os.remove(temporary)
+
+	# Evicts the least recently used entries until the cache fits in 90% of its maximum size, returning how many were evicted
+	def trim(self) -> int:
+		entries = {} # Key -> (last used, size)
+		total = 0
+		for root, _, files in os.walk(self.directory):
+			for name in files:
+				key, extension = os.path.splitext(name)
+				if extension not in [".cpp", ".json"] or name == STATS_NAME: continue
+				try: stat = os.stat(os.path.join(root, name))
+				except OSError: continue # Evicted by someone else
+				used, size = entries.get(key, (0, 0))
+				entries[key] = (max(used, stat.st_mtime), size + stat.st_size)
+				total += stat.st_size
+		if total <= self.max_size: return 0
+
+		evicted = 0
+		for key, (_, size) in sorted(entries.items(), key=lambda entry: entry[1][0]):
+			if total <= self.max_size * 0.9: break
+			for path in reversed(self.paths(key)): # NOTE: The prototypes go first so a half evicted entry is never mistaken for a complete one
+				try: os.remove(path)
+				except OSError: pass
+			total -= size
+			evicted += 1
+		return evicted
+
+	# Adds to the hits and misses recorded over the cache's lifetime
+	# NOTE: Best effort, concurrent runs can lose each other's counts
+	def record(self, hits: int, misses: int):
+		stats = self.stats()
+		stats["hits"] += hits
+		stats["misses"] += misses
+		os.makedirs(self.directory, exist_ok=True)
+		temporary = os.path.join(self.directory, f"{STATS_NAME}.{os.getpid()}-{uuid.uuid4().hex}.tmp")
+		with open(temporary, "w") as f:
+			json.dump(stats, f)
+		os.replace(temporary, os.path.join(self.directory, STATS_NAME))
+
+	def stats(self) -> dict[str, int]:
+		try:
+			with open(os.path.join(self.directory, STATS_NAME)) as f:
+				stats = json.load(f)
+			return { "hits": int(stats.get("hits", 0)), "misses": int(stats.get("misses", 0)) }
+		except (OSError, ValueError): return { "hits": 0, "misses": 0 }